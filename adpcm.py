@@ -1,54 +1,140 @@
 from struct import unpack
+from fractions import Fraction
+import numpy as np
+from sector import Codings
 
 K0 = [0, 960, 1840, 1568]
 K1 = [0, 0, -832, -880]
 sign16 = 1 << 15
 
-class ADPCMBlock():
-    def __init__(self, data):
-        temp = unpack("16s112s", data)
-        self.soundParameters = temp[0]
-        self.soundSamples = temp[1]
+GROUP_SIZE = 128
+GROUPS_PER_SECTOR = 18
+UNITS_PER_GROUP = 8
+SAMPLES_PER_UNIT = 28
+SAMPLES_PER_GROUP = UNITS_PER_GROUP * SAMPLES_PER_UNIT
+OUTPUT_RATE = 44100
 
-    def __signExtend16(self, value):
-        return (value & (sign16 - 1)) - (value & sign16)
+F0 = -np.array(K0, dtype=np.int64)
+F1 = -np.array(K1, dtype=np.int64)
 
 
-    def ReadPCM(self, prev1, prev2):
-        pcms = []
-        for blk in range(4):
-            for nibble in range(2):
-                for sd in range(28):
-                    shift = self.soundParameters[4 + (blk * 2) + nibble] & 0xF
-                    if shift > 12:
-                        shift = 9
-                    filter = (self.soundParameters[4 + (blk * 2) + nibble] & 0x30) >> 4
-                    f0 = -K0[filter]
-                    f1 = -K1[filter]
-                    idx = ((sd * 4) + blk)
-                    adpcmsample = (self.soundSamples[idx] >> (nibble * 4)) & 0xF
-                    extendedsample = self.__signExtend16(adpcmsample << 0xC) >> shift
-                    result = (extendedsample << 4) - (((prev1 * f0) + (prev2 * f1)) >> 10)
-                    prev2 = prev1
-                    prev1 = result
-                    result = result >> 4
-                    result = max(-32768, min(result, 32767))
-                    pcms.append(result)
-        return self.UpsampleLinear(pcms), prev1, prev2
-    
-    def UpsampleLinear(self, pcms):
+def _filter(samples, f0, f1, prev1, prev2):
+    # the only sequential part of the decoder, everything else is vectorized
+    result = [0] * len(samples)
+    for i in range(len(samples)):
+        value = samples[i] - ((prev1 * f0[i] + prev2 * f1[i]) >> 10)
+        prev2 = prev1
+        prev1 = value
+        result[i] = value
+    return result, prev1, prev2
+
+
+def DecodeGroups(groups, prev1=0, prev2=0):
+    # groups are 128-byte sound groups, 18 per sector, decoded in order with
+    # the filter state carried from one group to the next
+    groups = np.asarray(groups, dtype=np.uint8).reshape(-1, GROUP_SIZE)
+    parameters = groups[:, 4:12].astype(np.int64)
+    shift = parameters & 0xF
+    shift[shift > 12] = 9
+    filter = (parameters & 0x30) >> 4
+    # byte [sd * 4 + blk] holds unit blk * 2 in its low nibble and blk * 2 + 1 in its high one
+    data = groups[:, 16:].reshape(-1, SAMPLES_PER_UNIT, 4).astype(np.int64)
+    nibbles = np.stack((data & 0xF, data >> 4), axis=-1).transpose(0, 2, 3, 1).reshape(-1, UNITS_PER_GROUP, SAMPLES_PER_UNIT)
+    extended = ((((nibbles << 12) ^ sign16) - sign16) >> shift[:, :, None]) << 4
+    f0 = np.repeat(F0[filter], SAMPLES_PER_UNIT)
+    f1 = np.repeat(F1[filter], SAMPLES_PER_UNIT)
+    result, prev1, prev2 = _filter(extended.ravel().tolist(), f0.tolist(), f1.tolist(), prev1, prev2)
+    pcm = np.clip(np.array(result, dtype=np.int64) >> 4, -32768, 32767)
+    return pcm.reshape(-1, SAMPLES_PER_GROUP), prev1, prev2
+
+
+def DecodeSectors(payloads, prev1=0, prev2=0):
+    payloads = [bytes(p[:GROUPS_PER_SECTOR * GROUP_SIZE]) for p in payloads]
+    return DecodeGroups(np.frombuffer(b"".join(payloads), dtype=np.uint8), prev1, prev2)
+
+
+_upsampletables = {}
+
+
+def UpsampleTable(length):
+    # per-group 7/3 stepping kept for ADPCMBlock; it only depends on the
+    # length, so the float loop runs once and is reused for every group
+    table = _upsampletables.get(length)
+    if table is None:
         step = 1.0 / (7.0 / 3.0)
-        result = []
+        indexes = []
+        weights = []
         stepidx = 0.0
         idx = 0
-        while idx < (len(pcms)-1):
-            cursample = pcms[idx]
-            nextsample = pcms[idx + 1]
-            sample = int(cursample + ((nextsample - cursample) * stepidx))
-            result.append(sample)
+        while idx < (length - 1):
+            indexes.append(idx)
+            weights.append(stepidx)
             stepidx += step
             if stepidx > 1.0:
                 stepidx -= 1.0
                 idx += 1
-        result.append(pcms[idx])
-        return result
\ No newline at end of file
+        table = (np.array(indexes, dtype=np.intp), np.array(weights, dtype=np.float64), idx)
+        _upsampletables[length] = table
+    return table
+
+
+def UpsampleGroups(pcm):
+    pcm = np.asarray(pcm, dtype=np.int64)
+    indexes, weights, last = UpsampleTable(pcm.shape[1])
+    current = pcm[:, indexes].astype(np.float64)
+    following = pcm[:, indexes + 1].astype(np.float64)
+    samples = np.trunc(current + (following - current) * weights).astype(np.int64)
+    return np.concatenate((samples, pcm[:, last:last + 1]), axis=1)
+
+
+def SampleRate(coding):
+    return 18900 if coding & Codings.LowSampleRate.value else 37800
+
+
+class Resampler():
+    # linear interpolation at the exact rational ratio between the rates;
+    # the last input sample and the output phase carry over between chunks
+    # so blocks and sectors join without a seam
+    def __init__(self, inrate, outrate=OUTPUT_RATE):
+        ratio = Fraction(outrate, inrate)
+        self.__up = ratio.numerator
+        self.__down = ratio.denominator
+        self.__carry = np.empty(0, dtype=np.int64)
+        self.__phase = 0
+
+    def Process(self, samples):
+        up = self.__up
+        data = np.concatenate((self.__carry, np.asarray(samples, dtype=np.int64)))
+        if len(data) == 0:
+            return data
+        # output k sits at input position k * down / up, kept in 1/up units
+        end = (len(data) - 1) * up
+        positions = np.arange(self.__phase, end, self.__down, dtype=np.int64)
+        index = positions // up
+        current = data[index]
+        numerator = current * up + (data[index + 1] - current) * (positions % up)
+        result = np.where(numerator < 0, -(-numerator // up), numerator // up)
+        self.__phase += len(positions) * self.__down - end
+        self.__carry = data[-1:]
+        return result
+
+    def Flush(self):
+        # the last input sample is only emitted when an output lands on it
+        result = self.__carry if self.__phase == 0 else np.empty(0, dtype=np.int64)
+        self.__carry = np.empty(0, dtype=np.int64)
+        self.__phase = 0
+        return result
+
+
+class ADPCMBlock():
+    def __init__(self, data):
+        temp = unpack("16s112s", data)
+        self.soundParameters = temp[0]
+        self.soundSamples = temp[1]
+
+    def ReadPCM(self, prev1, prev2):
+        pcm, prev1, prev2 = DecodeGroups(np.frombuffer(self.soundParameters + self.soundSamples, dtype=np.uint8), prev1, prev2)
+        return self.UpsampleLinear(pcm[0].tolist()), prev1, prev2
+
+    def UpsampleLinear(self, pcms):
+        return UpsampleGroups([pcms])[0].tolist()
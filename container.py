@@ -0,0 +1,282 @@
+import os
+import json
+import lzma
+import zlib
+import struct
+import threading
+import numpy as np
+from collections import OrderedDict
+from sector import SECTOR_SIZE, HEADER_SIZE, RAW_SECTOR
+
+CONTAINER_SUFFIX = ".cdz"
+MAGIC = b"PDCZ"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQ")
+CHUNK_SECTORS = 64
+CACHE_CHUNKS = 16
+
+SYNC = np.frombuffer(b"\x00" + b"\xFF" * 10 + b"\x00", dtype=np.uint8)
+SYNC_SIZE = len(SYNC)
+STRIPPED_SIZE = SECTOR_SIZE - HEADER_SIZE
+
+
+# the part of each sector header that cannot be derived, kept outside the
+# compressed chunks so the index can be built without inflating anything
+CONTAINER_HEADER = np.dtype([
+    ("flags", "u1"),
+    ("minute", "u1"),
+    ("second", "u1"),
+    ("block", "u1"),
+    ("mode", "u1"),
+    ("filenumber", "u1"),
+    ("channel", "u1"),
+    ("submode", "u1"),
+    ("coding", "u1"),
+    ("subheader", "V4")
+])
+STRIPPED = 1
+
+COMPRESSORS = {
+    "zlib": (lambda data, level: zlib.compress(data, 9 if level is None else level), zlib.decompress),
+    "lzma": (lambda data, level: lzma.compress(data, preset=6 if level is None else level), lzma.decompress)
+}
+
+
+def _strip(raw, table):
+    full = len(raw) // SECTOR_SIZE
+    units = np.frombuffer(raw, dtype=np.uint8, count=full * SECTOR_SIZE).reshape(full, SECTOR_SIZE)
+    stripped = (units[:, :SYNC_SIZE] == SYNC).all(axis=1)
+    table["flags"][:full] = np.where(stripped, STRIPPED, 0)
+    table.view(np.uint8).reshape(-1, CONTAINER_HEADER.itemsize)[:full][stripped, 1:] = \
+        units[stripped, SYNC_SIZE:HEADER_SIZE]
+    tail = raw[full * SECTOR_SIZE:]
+    if stripped.all():
+        return units[:, HEADER_SIZE:].tobytes() + tail
+    # a unit without a sync pattern (audio, damaged or odd sized) is kept whole
+    return b"".join(
+        units[i, HEADER_SIZE:].tobytes() if stripped[i] else units[i].tobytes()
+        for i in range(full)
+    ) + tail
+
+
+def Pack(imagestream, destination, compression="zlib", chunksectors=CHUNK_SECTORS, level=None):
+    compress = COMPRESSORS[compression][0]
+    files = []
+    tables = []
+    offsets = []
+    firstunit = 0
+    with open(destination, "wb") as o:
+        o.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+        for fileid, s in enumerate(imagestream.Streams):
+            units = -(-s.Length // SECTOR_SIZE)
+            files.append({
+                "filename": imagestream.CueSheet.Files[fileid].Filename,
+                "length": s.Length,
+                "units": units,
+                "firstunit": firstunit,
+                "firstchunk": len(offsets)
+            })
+            table = np.zeros(units, dtype=CONTAINER_HEADER)
+            for unit in range(0, units, chunksectors):
+                raw = bytes(s.ReadAt(unit * SECTOR_SIZE, chunksectors * SECTOR_SIZE))
+                offsets.append(o.tell())
+                o.write(compress(_strip(raw, table[unit:unit + chunksectors]), level))
+            tables.append(table)
+            firstunit += units
+        offsets.append(o.tell())
+        footer = o.tell()
+        meta = json.dumps({
+            "cue": imagestream.CueSheet.ToString(),
+            "compression": compression,
+            "chunksectors": chunksectors,
+            "files": files
+        }).encode()
+        o.write(struct.pack("<I", len(meta)))
+        o.write(meta)
+        for table in tables:
+            o.write(table.tobytes())
+        o.write(np.array(offsets, dtype="<u8").tobytes())
+        o.seek(0, 0)
+        o.write(HEADER.pack(MAGIC, VERSION, 0, footer))
+
+
+class Container():
+    def __init__(self, filepath, cachechunks=CACHE_CHUNKS):
+        self.__filepath = filepath
+        self.__stream = open(filepath, "rb")
+        self.__lock = threading.Lock()
+        self.__cache = OrderedDict()
+        self.__cachechunks = cachechunks
+        magic, version, _, footer = HEADER.unpack(self.__stream.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a sector container".format(filepath))
+        self.__stream.seek(footer, 0)
+        metalength = struct.unpack("<I", self.__stream.read(4))[0]
+        meta = json.loads(self.__stream.read(metalength).decode())
+        self.__cue = meta["cue"]
+        self.__decompress = COMPRESSORS[meta["compression"]][1]
+        self.__chunksectors = meta["chunksectors"]
+        self.__files = meta["files"]
+        units = sum(f["units"] for f in self.__files)
+        self.__table = np.frombuffer(self.__stream.read(units * CONTAINER_HEADER.itemsize), dtype=CONTAINER_HEADER)
+        chunks = sum(-(-f["units"] // self.__chunksectors) for f in self.__files)
+        self.__offsets = np.frombuffer(self.__stream.read((chunks + 1) * 8), dtype="<u8").tolist()
+
+    def __restore(self, fileid, chunk):
+        info = self.__files[fileid]
+        first = chunk * self.__chunksectors
+        count = min(self.__chunksectors, info["units"] - first)
+        rawlength = min(count * SECTOR_SIZE, info["length"] - first * SECTOR_SIZE)
+        start = self.__offsets[info["firstchunk"] + chunk]
+        end = self.__offsets[info["firstchunk"] + chunk + 1]
+        self.__stream.seek(start, 0)
+        data = self.__decompress(self.__stream.read(end - start))
+        table = self.__table[info["firstunit"] + first:info["firstunit"] + first + count]
+        headers = table.view(np.uint8).reshape(-1, CONTAINER_HEADER.itemsize)[:, 1:]
+        stripped = (table["flags"] & STRIPPED) != 0
+        full = rawlength // SECTOR_SIZE
+        if stripped.all() and full == count:
+            raw = np.empty((count, SECTOR_SIZE), dtype=np.uint8)
+            raw[:, :SYNC_SIZE] = SYNC
+            raw[:, SYNC_SIZE:HEADER_SIZE] = headers
+            raw[:, HEADER_SIZE:] = np.frombuffer(data, dtype=np.uint8).reshape(count, STRIPPED_SIZE)
+            return raw.tobytes()
+        raw = bytearray()
+        position = 0
+        for i in range(full):
+            if stripped[i]:
+                raw += SYNC.tobytes() + headers[i].tobytes()
+                raw += data[position:position + STRIPPED_SIZE]
+                position += STRIPPED_SIZE
+            else:
+                raw += data[position:position + SECTOR_SIZE]
+                position += SECTOR_SIZE
+        raw += data[position:]
+        return bytes(raw)
+
+    def ReadChunk(self, fileid, chunk):
+        key = (fileid, chunk)
+        with self.__lock:
+            raw = self.__cache.get(key)
+            if raw is not None:
+                self.__cache.move_to_end(key)
+                return raw
+            raw = self.__restore(fileid, chunk)
+            self.__cache[key] = raw
+            if len(self.__cache) > self.__cachechunks:
+                self.__cache.popitem(last=False)
+            return raw
+
+    def Headers(self, fileid):
+        info = self.__files[fileid]
+        return self.__table[info["firstunit"]:info["firstunit"] + info["units"]]
+
+    def Open(self, fileid):
+        return Containerstream(self, fileid)
+
+    def Close(self):
+        with self.__lock:
+            self.__cache.clear()
+            self.__stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.Close()
+
+    @property
+    def Filepath(self):
+        return self.__filepath
+
+    @property
+    def Cue(self):
+        return self.__cue
+
+    @property
+    def Files(self):
+        return self.__files
+
+    @property
+    def ChunkSectors(self):
+        return self.__chunksectors
+
+
+class Containerstream():
+    # reads one track file of a container with the same calls as Filestream
+    def __init__(self, container, fileid):
+        self.__container = container
+        self.__fileid = fileid
+        info = container.Files[fileid]
+        self.__filename = info["filename"]
+        self.__length = info["length"]
+        self.__chunkbytes = container.ChunkSectors * SECTOR_SIZE
+
+    def Close(self):
+        # the container is shared by every track, its opener closes it
+        pass
+
+    @property
+    def Filepath(self):
+        return self.__container.Filepath
+
+    @property
+    def Filename(self):
+        return self.__filename
+
+    @property
+    def FileId(self):
+        return self.__fileid
+
+    @property
+    def Stream(self):
+        return None
+
+    @property
+    def Length(self):
+        return self.__length
+
+    @property
+    def View(self):
+        return None
+
+    def ReadAt(self, offset, length):
+        length = max(0, min(length, self.__length - offset))
+        if length == 0:
+            return memoryview(b"")
+        chunk, start = divmod(offset, self.__chunkbytes)
+        if start + length <= self.__chunkbytes:
+            return memoryview(self.__container.ReadChunk(self.__fileid, chunk))[start:start + length]
+        buffer = bytearray()
+        while len(buffer) < length:
+            raw = self.__container.ReadChunk(self.__fileid, chunk)
+            buffer += raw[start:start + length - len(buffer)]
+            chunk += 1
+            start = 0
+        return memoryview(buffer)
+
+    def CopyTo(self, target, offset, length):
+        # filestream imports this module, so its helper is looked up here
+        from filestream import WriteAll
+        while length > 0:
+            data = self.ReadAt(offset, min(length, self.__chunkbytes - offset % self.__chunkbytes))
+            if len(data) == 0:
+                return
+            WriteAll(target, data)
+            offset += len(data)
+            length -= len(data)
+
+    def ReadHeaders(self, offset=0, count=None):
+        available = (self.__length - offset) // SECTOR_SIZE
+        count = available if count is None else min(count, available)
+        if count <= 0:
+            return np.empty(0, dtype=RAW_SECTOR)
+        if offset % SECTOR_SIZE == 0:
+            first = offset // SECTOR_SIZE
+            headers = self.__container.Headers(self.__fileid)[first:first + count]
+            if ((headers["flags"] & STRIPPED) != 0).all():
+                return headers
+        return np.frombuffer(self.ReadAt(offset, count * SECTOR_SIZE), dtype=RAW_SECTOR, count=count)
+
+    def __repr__(self):
+        return "Container: " + self.__container.Filepath + " File: " + self.__filename + " Length: " + str(self.__length)
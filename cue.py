@@ -0,0 +1,224 @@
+import re
+from bisect import bisect_right
+
+SECTOR_SIZES = {
+    "AUDIO": 2352,
+    "CDG": 2448,
+    "MODE1/2048": 2048,
+    "MODE1/2352": 2352,
+    "MODE2/2048": 2048,
+    "MODE2/2324": 2324,
+    "MODE2/2336": 2336,
+    "MODE2/2352": 2352,
+    "CDI/2336": 2336,
+    "CDI/2352": 2352
+}
+
+# where the user data starts inside a stored sector of each track type
+PAYLOAD_OFFSETS = {
+    "MODE1/2352": 16,
+    "MODE2/2336": 8,
+    "MODE2/2352": 24,
+    "CDI/2336": 8,
+    "CDI/2352": 24
+}
+
+rgxMSF = re.compile(r'^(\d+):(\d+):(\d+)$')
+rgxFile = re.compile(r'^FILE\s+(?:"(.*)"|(\S+))\s+(\S+)$', re.IGNORECASE)
+
+
+def MSFToFrames(msf):
+    m = rgxMSF.match(msf)
+    return (int(m.group(1)) * 60 + int(m.group(2))) * 75 + int(m.group(3))
+
+
+def FramesToMSF(frames):
+    return "{:02}:{:02}:{:02}".format(frames // 4500, (frames // 75) % 60, frames % 75)
+
+
+class CueIndex():
+    def __init__(self, number, offset):
+        self.Number = number
+        self.Offset = offset
+
+    def __repr__(self):
+        return "<Index {:02} {}>".format(self.Number, FramesToMSF(self.Offset))
+
+
+class CueTrack():
+    def __init__(self, number, tracktype):
+        self.Number = number
+        self.TrackType = tracktype.upper()
+        self.Indexes = []
+        self.Pregap = 0
+        self.Postgap = 0
+        self.Extra = []
+        self.FileId = None
+        self.FileOffset = 0
+        self.Start = 0
+        self.End = 0
+
+    @property
+    def SectorSize(self):
+        return SECTOR_SIZES.get(self.TrackType, 2352)
+
+    @property
+    def PayloadOffset(self):
+        return PAYLOAD_OFFSETS.get(self.TrackType, 0)
+
+    @property
+    def IsData(self):
+        return self.TrackType != "AUDIO" and self.TrackType != "CDG"
+
+    @property
+    def IsMode2(self):
+        return self.TrackType.startswith("MODE2") or self.TrackType.startswith("CDI")
+
+    @property
+    def FirstIndex(self):
+        return self.Indexes[0].Offset if self.Indexes else 0
+
+    @property
+    def DataStart(self):
+        # absolute LBA of INDEX 01, the pregap and INDEX 00 come before it
+        for i in self.Indexes:
+            if i.Number == 1:
+                return self.Start + self.Pregap + i.Offset - self.FileOffset
+        return self.Start + self.Pregap
+
+    def __repr__(self):
+        return "<Track {:02} {} LBA {}-{} File {}>".format(
+            self.Number,
+            self.TrackType,
+            self.Start,
+            self.End,
+            self.FileId
+        )
+
+
+class CueFile():
+    def __init__(self, filename, filetype="BINARY"):
+        self.Filename = filename
+        self.FileType = filetype
+        self.Tracks = []
+
+    def __repr__(self):
+        return "<File \"{}\" {} Tracks {}>".format(self.Filename, self.FileType, len(self.Tracks))
+
+
+class CueSheet():
+    def __init__(self, filepath=None, text=None):
+        self.Files = []
+        self.Extra = []
+        self.__segments = []
+        self.__starts = []
+        if filepath is not None:
+            with open(filepath, "r") as f:
+                self.FromString(f.read())
+        elif text is not None:
+            self.FromString(text)
+
+    def FromString(self, text):
+        self.Files = []
+        self.Extra = []
+        track = None
+        for line in text.splitlines():
+            stripped = line.strip()
+            if not stripped:
+                continue
+            parts = stripped.split()
+            command = parts[0].upper()
+            if command == "FILE":
+                m = rgxFile.match(stripped)
+                self.Files.append(CueFile(m.group(1) if m.group(1) is not None else m.group(2), m.group(3)))
+                track = None
+            elif command == "TRACK":
+                track = CueTrack(int(parts[1]), parts[2])
+                track.FileId = len(self.Files) - 1
+                self.Files[-1].Tracks.append(track)
+            elif command == "INDEX" and track is not None:
+                track.Indexes.append(CueIndex(int(parts[1]), MSFToFrames(parts[2])))
+            elif command == "PREGAP" and track is not None:
+                track.Pregap = MSFToFrames(parts[1])
+            elif command == "POSTGAP" and track is not None:
+                track.Postgap = MSFToFrames(parts[1])
+            elif track is not None:
+                track.Extra.append(stripped)
+            else:
+                self.Extra.append(stripped)
+
+    def ToString(self, filenames=None):
+        lines = list(self.Extra)
+        for fileid, f in enumerate(self.Files):
+            filename = f.Filename if filenames is None else filenames[fileid]
+            lines.append('FILE "{}" {}'.format(filename, f.FileType))
+            for t in f.Tracks:
+                lines.append('  TRACK {:02} {}'.format(t.Number, t.TrackType))
+                lines.extend("    " + e for e in t.Extra)
+                if t.Pregap:
+                    lines.append('    PREGAP {}'.format(FramesToMSF(t.Pregap)))
+                for i in t.Indexes:
+                    lines.append('    INDEX {:02} {}'.format(i.Number, FramesToMSF(i.Offset)))
+                if t.Postgap:
+                    lines.append('    POSTGAP {}'.format(FramesToMSF(t.Postgap)))
+        return "\n".join(lines) + "\n"
+
+    def Layout(self, lengths):
+        # lay the files end to end on the disc; each segment is either a run
+        # of stored sectors or a PREGAP/POSTGAP that only exists on the disc
+        self.__segments = []
+        lba = 0
+        for fileid, f in enumerate(self.Files):
+            byteoffset = 0
+            for n, t in enumerate(f.Tracks):
+                t.Start = lba
+                t.FileOffset = byteoffset // t.SectorSize
+                if t.Pregap:
+                    self.__segments.append((lba, t.Pregap, t, None, 0, t.SectorSize))
+                    lba += t.Pregap
+                if n + 1 < len(f.Tracks):
+                    count = f.Tracks[n + 1].FirstIndex - (0 if n == 0 else t.FirstIndex)
+                else:
+                    count = (lengths[fileid] - byteoffset) // t.SectorSize
+                count = max(count, 0)
+                if count > 0:
+                    self.__segments.append((lba, count, t, fileid, byteoffset, t.SectorSize))
+                lba += count
+                byteoffset += count * t.SectorSize
+                if t.Postgap:
+                    self.__segments.append((lba, t.Postgap, t, None, 0, t.SectorSize))
+                    lba += t.Postgap
+                t.End = lba
+        self.__starts = [s[0] for s in self.__segments]
+
+    def Resolve(self, LBA):
+        i = bisect_right(self.__starts, LBA) - 1
+        if i < 0:
+            return None
+        start, count, track, fileid, byteoffset, sectorsize = self.__segments[i]
+        if LBA >= start + count or fileid is None:
+            return None
+        return track, fileid, byteoffset + (LBA - start) * sectorsize
+
+    def TrackAt(self, LBA):
+        i = bisect_right(self.__starts, LBA) - 1
+        if i < 0 or LBA >= self.__segments[i][0] + self.__segments[i][1]:
+            return None
+        return self.__segments[i][2]
+
+    @property
+    def Segments(self):
+        return self.__segments
+
+    @property
+    def Tracks(self):
+        return [t for f in self.Files for t in f.Tracks]
+
+    @property
+    def Length(self):
+        if not self.__segments:
+            return 0
+        return self.__segments[-1][0] + self.__segments[-1][1]
+
+    def __repr__(self):
+        return "\n".join(str(t) for t in self.Tracks)
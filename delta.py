@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import mmap
+import zlib
+import struct
+import shutil
+import numpy as np
+
+DELTA_SUFFIX = ".delta"
+DELTA_MAGIC = b"PDDL"
+DELTA_VERSION = 1
+DELTA_HEADER = struct.Struct("<4sHHI")
+DELTA_RECORD = struct.Struct("<HQIII")
+
+BPS_SUFFIX = ".bps"
+BPS_MAGIC = b"BPS1"
+SOURCE_READ = 0
+TARGET_READ = 1
+SOURCE_COPY = 2
+TARGET_COPY = 3
+# differing bytes closer than this are sent as one TargetRead
+BPS_GAP = 4
+CRC_CHUNK = 0x400000
+
+
+def WriteDelta(imagestream, filepath):
+    # one record per modified sector, with the CRC32 of the sector it replaces
+    records = bytearray()
+    count = 0
+    for fileid, changes in sorted(imagestream.Changes().items()):
+        s = imagestream.Streams[fileid]
+        for offset, data in changes:
+            source = s.ReadAt(offset, len(data))
+            records += DELTA_RECORD.pack(fileid, offset, len(data), zlib.crc32(source), zlib.crc32(data))
+            records += data
+            count += 1
+    meta = json.dumps({
+        "files": [{"filename": s.Filename, "length": s.Length} for s in imagestream.Streams],
+        "records": count
+    }).encode()
+    with open(filepath, "wb") as o:
+        o.write(DELTA_HEADER.pack(DELTA_MAGIC, DELTA_VERSION, 0, len(meta)))
+        o.write(meta)
+        o.write(zlib.compress(bytes(records), 9))
+    return count
+
+
+def ReadDelta(filepath):
+    with open(filepath, "rb") as f:
+        magic, version, _, metalength = DELTA_HEADER.unpack(f.read(DELTA_HEADER.size))
+        if magic != DELTA_MAGIC or version != DELTA_VERSION:
+            raise ValueError("{} is not a sector delta".format(filepath))
+        meta = json.loads(f.read(metalength).decode())
+        body = zlib.decompress(f.read())
+    records = []
+    position = 0
+    for _ in range(meta["records"]):
+        fileid, offset, length, sourcecrc, targetcrc = DELTA_RECORD.unpack_from(body, position)
+        position += DELTA_RECORD.size
+        records.append((fileid, offset, sourcecrc, targetcrc, body[position:position + length]))
+        position += length
+    return meta, records
+
+
+def ApplyDelta(filepath, folder, destination=None):
+    # every record is checked before anything is written, sectors that
+    # already hold the target are left alone so a delta can be re-applied
+    meta, records = ReadDelta(filepath)
+    files = meta["files"]
+    if destination is not None:
+        os.makedirs(destination, exist_ok=True)
+        for f in files:
+            shutil.copyfile(os.path.join(folder, f["filename"]), os.path.join(destination, f["filename"]))
+        folder = destination
+    pending = []
+    handles = {}
+    try:
+        for fileid, offset, sourcecrc, targetcrc, data in records:
+            handle = handles.get(fileid)
+            if handle is None:
+                path = os.path.join(folder, files[fileid]["filename"])
+                if os.path.getsize(path) != files[fileid]["length"]:
+                    raise ValueError("{} has the wrong size".format(path))
+                handle = open(path, "r+b")
+                handles[fileid] = handle
+            handle.seek(offset, 0)
+            crc = zlib.crc32(handle.read(len(data)))
+            if crc == targetcrc:
+                continue
+            if crc != sourcecrc:
+                raise ValueError("{} offset {:X} does not match the delta source".format(files[fileid]["filename"], offset))
+            pending.append((handle, offset, data))
+        for handle, offset, data in pending:
+            handle.seek(offset, 0)
+            handle.write(data)
+    finally:
+        for handle in handles.values():
+            handle.close()
+    return len(pending)
+
+
+def EncodeNumber(value):
+    encoded = bytearray()
+    while True:
+        x = value & 0x7F
+        value >>= 7
+        if value == 0:
+            encoded.append(0x80 | x)
+            return encoded
+        encoded.append(x)
+        value -= 1
+
+
+def DecodeNumber(data, position):
+    value = 0
+    shift = 1
+    while True:
+        x = data[position]
+        position += 1
+        value += (x & 0x7F) * shift
+        if x & 0x80:
+            return value, position
+        shift <<= 7
+        value += shift
+
+
+def _runs(source, target):
+    diff = np.flatnonzero(np.frombuffer(source, dtype=np.uint8) != np.frombuffer(target, dtype=np.uint8))
+    if len(diff) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(diff) > BPS_GAP) + 1
+    return [(int(run[0]), int(run[-1]) + 1) for run in np.split(diff, breaks)]
+
+
+def _crc(stream, changes):
+    sourcecrc = 0
+    targetcrc = 0
+    position = 0
+    for offset in range(0, stream.Length, CRC_CHUNK):
+        sourcecrc = zlib.crc32(stream.ReadAt(offset, CRC_CHUNK), sourcecrc)
+    for offset, data in changes + [(stream.Length, b"")]:
+        while position < offset:
+            chunk = stream.ReadAt(position, min(CRC_CHUNK, offset - position))
+            targetcrc = zlib.crc32(chunk, targetcrc)
+            position += len(chunk)
+        targetcrc = zlib.crc32(data, targetcrc)
+        position = offset + len(data)
+    return sourcecrc, targetcrc
+
+
+def WriteBPS(stream, changes, filepath, metadata=b""):
+    # the target has the source layout so unchanged bytes are SourceReads
+    # and only the differing runs are carried in the patch
+    patch = bytearray(BPS_MAGIC)
+    patch += EncodeNumber(stream.Length)
+    patch += EncodeNumber(stream.Length)
+    patch += EncodeNumber(len(metadata))
+    patch += metadata
+    position = 0
+    for offset, data in changes:
+        source = stream.ReadAt(offset, len(data))
+        for start, end in _runs(source, data):
+            if offset + start > position:
+                patch += EncodeNumber(((offset + start - position - 1) << 2) | SOURCE_READ)
+            patch += EncodeNumber(((end - start - 1) << 2) | TARGET_READ)
+            patch += data[start:end]
+            position = offset + end
+    if stream.Length > position:
+        patch += EncodeNumber(((stream.Length - position - 1) << 2) | SOURCE_READ)
+    sourcecrc, targetcrc = _crc(stream, changes)
+    patch += struct.pack("<II", sourcecrc, targetcrc)
+    patch += struct.pack("<I", zlib.crc32(patch))
+    with open(filepath, "wb") as o:
+        o.write(patch)
+
+
+def ApplyBPS(filepath, sourcepath, targetpath):
+    with open(filepath, "rb") as f:
+        patch = f.read()
+    if patch[:4] != BPS_MAGIC:
+        raise ValueError("{} is not a BPS patch".format(filepath))
+    if zlib.crc32(patch[:-4]) != struct.unpack("<I", patch[-4:])[0]:
+        raise ValueError("{} is damaged".format(filepath))
+    sourcecrc, targetcrc = struct.unpack("<II", patch[-12:-4])
+    sourcesize, position = DecodeNumber(patch, 4)
+    targetsize, position = DecodeNumber(patch, position)
+    metasize, position = DecodeNumber(patch, position)
+    position += metasize
+    with open(sourcepath, "rb") as s:
+        source = mmap.mmap(s.fileno(), 0, access=mmap.ACCESS_READ) if sourcesize > 0 else b""
+    try:
+        if len(source) != sourcesize or zlib.crc32(source) != sourcecrc:
+            raise ValueError("{} does not match the patch source".format(sourcepath))
+        target = bytearray(targetsize)
+        output = 0
+        sourcerelative = 0
+        targetrelative = 0
+        end = len(patch) - 12
+        while position < end:
+            data, position = DecodeNumber(patch, position)
+            command = data & 3
+            length = (data >> 2) + 1
+            if command == SOURCE_READ:
+                target[output:output + length] = source[output:output + length]
+            elif command == TARGET_READ:
+                target[output:output + length] = patch[position:position + length]
+                position += length
+            else:
+                data, position = DecodeNumber(patch, position)
+                delta = (-1 if data & 1 else 1) * (data >> 1)
+                if command == SOURCE_COPY:
+                    sourcerelative += delta
+                    target[output:output + length] = source[sourcerelative:sourcerelative + length]
+                    sourcerelative += length
+                else:
+                    # target copies may overlap the bytes they produce
+                    targetrelative += delta
+                    for i in range(length):
+                        target[output + i] = target[targetrelative + i]
+                    targetrelative += length
+            output += length
+    finally:
+        if isinstance(source, mmap.mmap):
+            source.close()
+    if zlib.crc32(target) != targetcrc:
+        raise ValueError("patched {} does not match the patch target".format(targetpath))
+    with open(targetpath, "wb") as o:
+        o.write(target)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: delta.py patch.delta folder [destination] | delta.py patch.bps source.bin target.bin")
+    elif sys.argv[1].endswith(BPS_SUFFIX):
+        ApplyBPS(sys.argv[1], sys.argv[2], sys.argv[3])
+    else:
+        print("{} sectors written".format(ApplyDelta(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)))
@@ -0,0 +1,299 @@
+import os
+import wave
+import numpy as np
+from adpcm import DecodeSectors, Resampler, SampleRate, OUTPUT_RATE
+from manifest import SourceHash
+
+
+class Sink():
+    # Start returns the LBAs the sink wants, Feed then gets their payloads
+    # in ascending order; Done lets the demultiplexer stop reading early
+    def __init__(self, manifest=None):
+        self.Done = False
+        self.Manifest = manifest
+        self.Options = {}
+
+    def Hash(self):
+        return SourceHash() if self.Manifest is not None else None
+
+    def Emit(self, filename, lbas, digest, write):
+        # outputs whose source sectors and options are unchanged are kept
+        if self.Manifest is not None and \
+           self.Manifest.Current(filename, lbas, digest.hexdigest(), self.Options):
+            return False
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        write(filename)
+        if self.Manifest is not None:
+            self.Manifest.Record(filename, lbas, digest.hexdigest(), self.Options)
+        return True
+
+    def Start(self, interleave):
+        return np.empty(0, dtype=np.int64)
+
+    def Feed(self, lba, payload):
+        pass
+
+    def Finish(self):
+        pass
+
+
+class RecordSink(Sink):
+    # sinks that gather their sectors into records and emit one output per record
+    def __init__(self, limit=0, manifest=None):
+        super().__init__(manifest)
+        self.Limit = limit
+        self.__records = []
+        self.__record = 0
+        self.__fed = 0
+
+    def Records(self, interleave):
+        return []
+
+    def Start(self, interleave):
+        self.__records = self.Records(interleave)
+        self.__record = 0
+        self.__fed = 0
+        self.Done = len(self.__records) == 0
+        if self.Done:
+            return np.empty(0, dtype=np.int64)
+        self.BeginRecord()
+        return np.concatenate([lbas for _, lbas in self.__records])
+
+    def Feed(self, lba, payload):
+        self.FeedRecord(lba, payload)
+        self.__fed += 1
+        counter, lbas = self.__records[self.__record]
+        if self.__fed < len(lbas):
+            return
+        self.EndRecord(counter)
+        self.__record += 1
+        self.__fed = 0
+        if (self.Limit > 0 and self.LimitReached(counter)) or self.__record == len(self.__records):
+            self.Done = True
+        else:
+            self.BeginRecord()
+
+    def LimitReached(self, counter):
+        return counter + 1 >= self.Limit
+
+    def BeginRecord(self):
+        pass
+
+    def FeedRecord(self, lba, payload):
+        pass
+
+    def EndRecord(self, counter):
+        pass
+
+
+# sectors decoded and written per step, bounds the PCM held for a clip
+AUDIO_CHUNK = 32
+AUDIO_TEMP = "audio.wav.tmp"
+
+
+class AudioSink(RecordSink):
+    def __init__(self, destination, limit=0, manifest=None, native=False):
+        super().__init__(limit, manifest)
+        self.Destination = destination
+        self.Native = native
+        self.Options = {"format": "wav", "rate": "native"} if native else {"format": "wav", "rate": OUTPUT_RATE, "resampler": "linear"}
+        self.__interleave = None
+        self.__payloads = []
+        self.__lbas = []
+        self.__hash = None
+        self.__wavefile = None
+        self.__resampler = None
+        self.__prev1 = 0
+        self.__prev2 = 0
+
+    def Records(self, interleave):
+        self.__interleave = interleave
+        return list(interleave.AudioRecords())
+
+    def LimitReached(self, counter):
+        # clips are numbered by the data records before them, not by count
+        return counter >= self.Limit
+
+    def BeginRecord(self):
+        self.__payloads = []
+        self.__lbas = []
+        self.__hash = self.Hash()
+        self.__prev1 = 0
+        self.__prev2 = 0
+
+    def FeedRecord(self, lba, payload):
+        # the clip is decoded into a temporary file as it arrives, so only
+        # AUDIO_CHUNK sectors are ever held whatever the length of the clip
+        self.__payloads.append(bytes(payload))
+        self.__lbas.append(lba)
+        if self.__hash is not None:
+            self.__hash.update(payload)
+        if len(self.__payloads) == AUDIO_CHUNK:
+            self.__decode()
+
+    def EndRecord(self, counter):
+        self.__decode()
+        if self.__resampler is not None:
+            self.__wavefile.writeframes(self.__resampler.Flush().astype("<i2").tobytes())
+        self.__wavefile.close()
+        self.__wavefile = None
+        filename = os.path.join(self.Destination, "audio_{:03}.wav".format(counter))
+        if not self.Emit(filename, self.__lbas, self.__hash, self.__write):
+            os.remove(self.__temp)
+
+    def Finish(self):
+        # a clip cut short by the demultiplexer leaves no partial file behind
+        if self.__wavefile is not None:
+            self.__wavefile.close()
+            self.__wavefile = None
+            os.remove(self.__temp)
+
+    @property
+    def __temp(self):
+        return os.path.join(self.Destination, AUDIO_TEMP)
+
+    def __open(self):
+        rate = SampleRate(self.__interleave.Coding(self.__lbas[0])) if self.__lbas else OUTPUT_RATE
+        self.__resampler = None if self.Native else Resampler(rate)
+        os.makedirs(self.Destination, exist_ok=True)
+        self.__wavefile = wave.open(self.__temp, "wb")
+        self.__wavefile.setparams((1, 2, rate if self.Native else OUTPUT_RATE, 0, "NONE", "not compressed"))
+
+    def __decode(self):
+        if self.__wavefile is None:
+            self.__open()
+        if not self.__payloads:
+            return
+        pcm, self.__prev1, self.__prev2 = DecodeSectors(self.__payloads, self.__prev1, self.__prev2)
+        pcm = pcm.ravel()
+        if self.__resampler is not None:
+            pcm = self.__resampler.Process(pcm)
+        self.__wavefile.writeframes(pcm.astype("<i2").tobytes())
+        self.__payloads = []
+
+    def __write(self, filename):
+        os.replace(self.__temp, filename)
+
+
+class VideoSink(RecordSink):
+    def __init__(self, destination, limit=0, manifest=None):
+        super().__init__(limit, manifest)
+        self.Destination = destination
+        self.Options = {"format": "raw"}
+        self.__bytes = bytearray()
+        self.__lbas = []
+        self.__hash = None
+
+    def Records(self, interleave):
+        return list(enumerate(interleave.VideoRecords()))
+
+    def BeginRecord(self):
+        self.__bytes = bytearray()
+        self.__lbas = []
+        self.__hash = self.Hash()
+
+    def FeedRecord(self, lba, payload):
+        self.__bytes += payload
+        self.__lbas.append(lba)
+        if self.__hash is not None:
+            self.__hash.update(payload)
+
+    def EndRecord(self, counter):
+        filename = os.path.join(self.Destination, "video_{:03}.bin".format(counter))
+        self.Emit(filename, self.__lbas, self.__hash, self.__write)
+
+    def __write(self, filename):
+        with open(filename, "wb") as o:
+            o.write(self.__bytes)
+
+
+class FrameSink(RecordSink):
+    def __init__(self, destination, limit=0, manifest=None):
+        super().__init__(limit, manifest)
+        self.Destination = destination
+        self.Options = {"format": "raw"}
+        # a frame may start in one record and end in the next
+        self.__bytes = bytearray()
+        self.__lbas = []
+        self.__hash = self.Hash()
+        self.__counter = 0
+        self.__framecounter = 0
+
+    def Records(self, interleave):
+        self.__bytes = bytearray()
+        self.__lbas = []
+        self.__hash = self.Hash()
+        self.__counter = 0
+        return list(enumerate(interleave.VideoRecords()))
+
+    def BeginRecord(self):
+        self.__framecounter = 0
+
+    def FeedRecord(self, lba, payload):
+        if payload[0] == 0xF3:
+            return
+        self.__bytes += payload
+        self.__lbas.append(lba)
+        if self.__hash is not None:
+            self.__hash.update(payload)
+        if payload[0] == 0xF2:
+            filename = os.path.join(self.Destination, "{:03}/frame_{:04}.bin".format(self.__counter, self.__framecounter))
+            self.Emit(filename, self.__lbas, self.__hash, self.__write)
+            self.__bytes = bytearray()
+            self.__lbas = []
+            self.__hash = self.Hash()
+            self.__framecounter += 1
+
+    def EndRecord(self, counter):
+        self.__counter = counter + 1
+
+    def __write(self, filename):
+        with open(filename, "wb") as o:
+            o.write(self.__bytes)
+
+
+class CallbackSink(Sink):
+    # select picks the LBAs from the interleave, every sector by default
+    def __init__(self, callback, select=None, finish=None):
+        super().__init__()
+        self.__callback = callback
+        self.__select = select
+        self.__finish = finish
+
+    def Start(self, interleave):
+        self.Done = False
+        return interleave.LBAs if self.__select is None else np.asarray(self.__select(interleave))
+
+    def Feed(self, lba, payload):
+        if self.__callback(lba, payload) is False:
+            self.Done = True
+
+    def Finish(self):
+        if self.__finish is not None:
+            self.__finish()
+
+
+def Demux(interleave, sinks, readpayloads):
+    wanted = [np.asarray(sink.Start(interleave), dtype=np.int64) for sink in sinks]
+    lbas = np.unique(np.concatenate(wanted)) if wanted else np.empty(0, dtype=np.int64)
+    # one bit per sink tells which of them take each sector
+    targets = np.zeros(len(lbas), dtype=np.int64)
+    for n, w in enumerate(wanted):
+        targets[np.isin(lbas, w)] |= 1 << n
+    patterns = {
+        bits: [sink for n, sink in enumerate(sinks) if bits & (1 << n)]
+        for bits in np.unique(targets).tolist()
+    }
+    targets = targets.tolist()
+    if len(lbas) > 0 and not all(sink.Done for sink in sinks):
+        with readpayloads([lbas]) as payloads:
+            for (lba, payload), bits in zip(payloads, targets):
+                active = False
+                for sink in patterns[bits]:
+                    if not sink.Done:
+                        sink.Feed(lba, payload)
+                        active = True
+                if active and all(sink.Done for sink in sinks):
+                    break
+    for sink in sinks:
+        sink.Finish()
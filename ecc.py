@@ -0,0 +1,164 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from sector import SECTOR_SIZE, Submodes
+from container import Container, Containerstream
+
+EDC_POLY = 0xD8018001
+GF_POLY = 0x11D
+
+# offsets inside a raw 2352-byte Mode 2 sector
+FORM1_EDC = 0x818
+FORM2_EDC = 0x92C
+ECC_P = 0x81C
+ECC_Q = 0x8C8
+ECC_START = 0xC
+
+# (major count, minor count, major multiplier, minor increment) from ECMA-130
+P_BLOCK = (86, 24, 2, 86)
+Q_BLOCK = (52, 43, 86, 88)
+
+VERIFY_CHUNK = 2048
+
+
+def _tables():
+    f = np.zeros(256, dtype=np.uint8)
+    b = np.zeros(256, dtype=np.uint8)
+    edc = np.zeros(256, dtype=np.uint32)
+    for i in range(256):
+        j = (i << 1) ^ (GF_POLY if i & 0x80 else 0)
+        f[i] = j & 0xFF
+        b[i ^ f[i]] = i
+        e = i
+        for _ in range(8):
+            e = (e >> 1) ^ (EDC_POLY if e & 1 else 0)
+        edc[i] = e
+    return f, b, edc
+
+ECC_F, ECC_B, EDC_LUT = _tables()
+
+
+def _blocktables(block):
+    major_count, minor_count, major_mult, minor_inc = block
+    size = major_count * minor_count
+    gather = np.zeros((major_count, minor_count), dtype=np.intp)
+    for major in range(major_count):
+        index = (major >> 1) * major_mult + (major & 1)
+        for minor in range(minor_count):
+            gather[major, minor] = index
+            index += minor_inc
+            if index >= size:
+                index -= size
+    # the serial loop multiplies the running sum by alpha after every byte,
+    # so byte k ends up multiplied by alpha^(minor_count - k)
+    weights = np.zeros((minor_count, 256), dtype=np.uint8)
+    row = np.arange(256, dtype=np.uint8)
+    for k in range(minor_count - 1, -1, -1):
+        row = ECC_F[row]
+        weights[k] = row
+    return gather, weights
+
+P_GATHER, P_WEIGHTS = _blocktables(P_BLOCK)
+Q_GATHER, Q_WEIGHTS = _blocktables(Q_BLOCK)
+
+
+def ComputeEDC(sectors, start, end):
+    sectors = np.asarray(sectors, dtype=np.uint8).reshape(-1, SECTOR_SIZE)
+    edc = np.zeros(len(sectors), dtype=np.uint32)
+    for column in sectors[:, start:end].T:
+        edc = (edc >> 8) ^ EDC_LUT[(edc ^ column) & 0xFF]
+    return edc
+
+
+def _eccblock(region, gather, weights):
+    values = region[:, gather]
+    a = np.bitwise_xor.reduce(weights[np.arange(weights.shape[0]), values], axis=-1)
+    b = np.bitwise_xor.reduce(values, axis=-1)
+    a = ECC_B[ECC_F[a] ^ b]
+    return np.concatenate((a, a ^ b), axis=-1)
+
+
+def ComputeECC(sectors):
+    sectors = np.array(sectors, dtype=np.uint8).reshape(-1, SECTOR_SIZE)
+    # Mode 2 parity is computed with the header address zeroed
+    sectors[:, ECC_START:ECC_START + 4] = 0
+    p = _eccblock(sectors[:, ECC_START:ECC_P], P_GATHER, P_WEIGHTS)
+    sectors[:, ECC_P:ECC_Q] = p
+    q = _eccblock(sectors[:, ECC_START:ECC_Q], Q_GATHER, Q_WEIGHTS)
+    return p, q
+
+
+def Regenerate(sector):
+    raw = np.frombuffer(bytes(sector), dtype=np.uint8).reshape(1, SECTOR_SIZE)
+    result = bytearray(sector)
+    if raw[0, 18] & Submodes.Form.value:
+        edc = ComputeEDC(raw, 0x10, FORM2_EDC)
+        result[FORM2_EDC:FORM2_EDC + 4] = edc.astype("<u4").tobytes()
+    else:
+        edc = ComputeEDC(raw, 0x10, FORM1_EDC)
+        result[FORM1_EDC:FORM1_EDC + 4] = edc.astype("<u4").tobytes()
+        p, q = ComputeECC(np.frombuffer(bytes(result), dtype=np.uint8))
+        result[ECC_P:ECC_Q] = p.tobytes()
+        result[ECC_Q:SECTOR_SIZE] = q.tobytes()
+    return result
+
+
+def Verify(sectors):
+    sectors = np.asarray(sectors, dtype=np.uint8).reshape(-1, SECTOR_SIZE)
+    valid = np.ones(len(sectors), dtype=bool)
+    if len(sectors) == 0:
+        return valid
+    form2 = (sectors[:, 18] & Submodes.Form.value) != 0
+    # EDC is a running CRC so the Form 1 value falls out of the Form 2 pass
+    edc = np.zeros(len(sectors), dtype=np.uint32)
+    for position in range(0x10, FORM2_EDC):
+        if position == FORM1_EDC:
+            form1edc = edc
+        edc = (edc >> 8) ^ EDC_LUT[(edc ^ sectors[:, position]) & 0xFF]
+    storedform2 = sectors[:, FORM2_EDC:FORM2_EDC + 4].copy().view("<u4")[:, 0]
+    storedform1 = sectors[:, FORM1_EDC:FORM1_EDC + 4].copy().view("<u4")[:, 0]
+    # Form 2 EDC is optional, a zero means it was never computed
+    valid[form2] = (storedform2[form2] == 0) | (storedform2[form2] == edc[form2])
+    form1 = ~form2
+    if form1.any():
+        p, q = ComputeECC(sectors[form1])
+        valid[form1] = (storedform1[form1] == form1edc[form1]) & \
+                       (p == sectors[form1, ECC_P:ECC_Q]).all(axis=1) & \
+                       (q == sectors[form1, ECC_Q:SECTOR_SIZE]).all(axis=1)
+    return valid
+
+
+def VerifyChunk(filepath, offset, count, lbas, fileid=None):
+    if fileid is None:
+        raw = np.fromfile(filepath, dtype=np.uint8, count=count * SECTOR_SIZE, offset=offset)
+    else:
+        with Container(filepath) as container:
+            raw = np.frombuffer(container.Open(fileid).ReadAt(offset, count * SECTOR_SIZE), dtype=np.uint8)
+    raw = raw[:(len(raw) // SECTOR_SIZE) * SECTOR_SIZE].reshape(-1, SECTOR_SIZE)
+    lbas = np.asarray(lbas)[:len(raw)]
+    return lbas[~Verify(raw)].tolist()
+
+
+def VerifyImage(imagestream, workers=None):
+    index = imagestream.Index
+    lbas = np.flatnonzero(index["mode"] == 2)
+    tasks = []
+    for start in range(0, len(lbas), VERIFY_CHUNK):
+        chunk = lbas[start:start + VERIFY_CHUNK]
+        # split wherever the run leaves a track or skips a sector
+        streams = index["streamid"][chunk]
+        breaks = np.flatnonzero((np.diff(chunk) != 1) | (np.diff(streams) != 0)) + 1
+        for run in np.split(chunk, breaks):
+            first = index[run[0]]
+            stream = imagestream.Streams[first["streamid"]]
+            fileid = stream.FileId if isinstance(stream, Containerstream) else None
+            tasks.append((stream.Filepath, int(first["offset"]), len(run), run, fileid))
+    bad = []
+    if workers == 1 or len(tasks) <= 1:
+        for task in tasks:
+            bad.extend(VerifyChunk(*task))
+        return bad
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for result in pool.map(VerifyChunk, *zip(*tasks)):
+            bad.extend(result)
+    return bad
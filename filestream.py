@@ -1,16 +1,61 @@
 import os
-import re
-from sector import Sector, Submodes
+import mmap
+import threading
+import numpy as np
+from ecc import Regenerate
+from sector import Sector, Submodes, SECTOR_SIZE, HEADER_SIZE, RAW_SECTOR, HEADER_FIELDS, SECTOR_INDEX
+from cue import CueSheet
+from prefetch import Prefetcher
+from container import Container, CONTAINER_SUFFIX
 from pathlib import Path
 
+COPY_CHUNK = 0x400000
+VIRTUAL_STREAM = 0xFFFF
+
+
+def WriteAll(target, data):
+    # unbuffered writes may take only part of the data
+    view = memoryview(data).cast("B")
+    while len(view) > 0:
+        written = target.write(view)
+        if not written:
+            raise OSError("short write to {}".format(getattr(target, "name", target)))
+        view = view[written:]
+
 
 class Filestream():
-    def __init__(self, filepath=None):
+    def __init__(self, filepath=None, usemmap=False):
+        self.__filepath = filepath
         self.__filename = os.path.basename(filepath)
         self.__stream = open(filepath,'rb')
         self.__stream.seek(0, 2)
         self.__length = self.__stream.tell()
         self.__stream.seek(0,0)
+        self.__map = None
+        self.__view = None
+        # seek and read must not interleave with a prefetch thread
+        self.__lock = threading.Lock()
+        if usemmap and self.__length > 0:
+            self.__map = mmap.mmap(self.__stream.fileno(), 0, access=mmap.ACCESS_READ)
+            self.__view = memoryview(self.__map)
+
+    def Close(self):
+        if self.__view is not None:
+            self.__view.release()
+            self.__view = None
+        if self.__map is not None:
+            try:
+                self.__map.close()
+            except BufferError:
+                # slices handed out by ReadSector are still alive, the map
+                # is released once the last of them is collected
+                pass
+            self.__map = None
+        self.__stream.close()
+
+    @property
+    def Filepath(self):
+        return self.__filepath
 
     @property
     def Filename(self):
@@ -24,64 +69,209 @@ class Filestream():
     def Length(self):
         return self.__length
 
+    @property
+    def View(self):
+        return self.__view
+
+    def ReadAt(self, offset, length):
+        if self.__view is not None:
+            return self.__view[offset:offset + length]
+        with self.__lock:
+            self.__stream.seek(offset, 0)
+            return memoryview(self.__stream.read(length))
+
+    def CopyTo(self, target, offset, length):
+        # target must be unbuffered so that copy_file_range and plain writes
+        # share the same file position
+        if length <= 0:
+            return
+        if self.__view is None and hasattr(os, "copy_file_range"):
+            try:
+                while length > 0:
+                    copied = os.copy_file_range(self.__stream.fileno(), target.fileno(),
+                                                min(length, COPY_CHUNK), offset)
+                    if copied == 0:
+                        # nothing copied, the plain reads below either finish
+                        # the job or find the real end of the file
+                        break
+                    offset += copied
+                    length -= copied
+            except OSError:
+                pass
+        while length > 0:
+            chunk = self.ReadAt(offset, min(length, COPY_CHUNK))
+            if len(chunk) == 0:
+                return
+            WriteAll(target, chunk)
+            offset += len(chunk)
+            length -= len(chunk)
+
+    def ReadHeaders(self, offset=0, count=None):
+        available = (self.__length - offset) // SECTOR_SIZE
+        count = available if count is None else min(count, available)
+        if count <= 0:
+            return np.empty(0, dtype=RAW_SECTOR)
+        if self.__view is not None:
+            return np.frombuffer(self.__view, dtype=RAW_SECTOR, count=count, offset=offset)
+        return np.memmap(self.__stream, dtype=RAW_SECTOR, mode="r", offset=offset, shape=(count,))
+
     def __repr__(self):
         return "Stream: " + str(self.__stream) + " Length: " + str(self.__length)
 
 
+class SectorTable():
+    def __init__(self, imagestream):
+        self.__imagestream = imagestream
+
+    def __len__(self):
+        return len(self.__imagestream.Index)
+
+    def __getitem__(self, LBA):
+        return self.__imagestream.GetSector(LBA)
+
+
 class Imagestream():
-    def __init__(self, filepath=None):
+    def __init__(self, filepath=None, usemmap=False, indexcache=None):
         self.__streams = []
-        self.__sectors = []
+        self.__container = None
+        self.__cuesheet = CueSheet()
+        self.__index = np.empty(0, dtype=SECTOR_INDEX)
+        self.__sectors = {}
         self.__position = 0
+        self.__usemmap = usemmap
         if filepath:
             self.__readcue(filepath)
-            self.__readsectors()
+            if indexcache is not None and indexcache.Load(s.Filepath for s in self.__streams):
+                self.__index = indexcache.Index
+            else:
+                self.__readsectors()
 
     def __readcue(self, filepath):
         self.__streams = []
         p = Path(filepath)
         if p.suffix == ".cue":
-            with open(filepath, "r") as f:
-                rgxCue = re.compile(r'FILE \"(.*)\" BINARY\s+TRACK (\d+) MODE(\d)\/(\d+)\s+INDEX (\d+) (?:(\d+):(\d+):(\d+))')
-                strCueSheet = f.read()
-                matches = rgxCue.findall(strCueSheet)
-                for m in matches:
-                    filestream = Filestream(
-                        os.path.join(p.parent, m[0])
-                    )
-                    self.__streams.append(filestream)
+            self.__cuesheet = CueSheet(filepath)
+            for f in self.__cuesheet.Files:
+                filestream = Filestream(
+                    os.path.join(p.parent, f.Filename),
+                    self.__usemmap
+                )
+                self.__streams.append(filestream)
+        elif p.suffix == CONTAINER_SUFFIX:
+            self.__container = Container(filepath)
+            self.__cuesheet = CueSheet(text=self.__container.Cue)
+            self.__streams = [self.__container.Open(i) for i in range(len(self.__container.Files))]
+        self.__cuesheet.Layout([s.Length for s in self.__streams])
 
     def __writecue(self, path, name, streams):
         filepath = os.path.join(path, "{}.cue".format(name))
         with open(filepath, "w") as f:
-            for i in range(len(streams)):
-                s = streams[i]
-                f.write('FILE "{}" BINARY\n'.format(s["filename"]))
-                f.write('  TRACK {:02} MODE2/2352\n'.format(i+1))
-                f.write('    INDEX 01 00:00:00\n')
-
+            f.write(self.__cuesheet.ToString([s["filename"] for s in streams]))
 
     def __readsectors(self):
-        self.__sectors = []
-        for filestreamid in range(len(self.__streams)):
-            s = self.__streams[filestreamid]
-            index = 0
-            while index < s.Length:
-                s.Stream.seek(index, 0)
-                buffer = s.Stream.read(24)
-                header = Sector(buffer, filestreamid, index)
-                self.__sectors.append(header)
-                index += 2352
+        self.__sectors = {}
+        self.__index = np.zeros(self.__cuesheet.Length, dtype=SECTOR_INDEX)
+        self.__index["streamid"] = VIRTUAL_STREAM
+        for start, count, track, fileid, byteoffset, sectorsize in self.__cuesheet.Segments:
+            if fileid is None:
+                continue
+            rows = self.__index[start:start + count]
+            rows["streamid"] = fileid
+            rows["offset"] = byteoffset + np.arange(count, dtype=np.uint64) * sectorsize
+            if not track.IsData or sectorsize != SECTOR_SIZE:
+                continue
+            raw = self.__streams[fileid].ReadHeaders(byteoffset, count)
+            # Mode 1 sectors carry user data where Mode 2 has its subheader
+            for field in (HEADER_FIELDS if track.IsMode2 else HEADER_FIELDS[:4]):
+                rows[field][:len(raw)] = raw[field]
+            del raw
+
+    def __locate(self, LBA):
+        if LBA < 0 or LBA >= len(self.__index):
+            raise IndexError("LBA {} outside of the image".format(LBA))
+        return self.__cuesheet.Resolve(LBA)
+
+    def __sectorlength(self, LBA, track):
+        if not track.IsData:
+            return track.SectorSize
+        if not track.IsMode2:
+            return 2048
+        return 2324 if (self.__index["submode"][LBA] & Submodes.Form.value) else 2048
+
+    def __loadsector(self, LBA) -> Sector:
+        location = self.__locate(LBA)
+        if location is None:
+            return Sector(bytes(HEADER_SIZE), VIRTUAL_STREAM, 0)
+        track, fileid, offset = location
+        return Sector(self.__streams[fileid].ReadAt(offset, HEADER_SIZE), fileid, offset)
+
+    def GetSector(self, LBA) -> Sector:
+        sector = self.__sectors.get(LBA)
+        if sector is None:
+            sector = self.__loadsector(LBA)
+            self.__sectors[LBA] = sector
+        return sector
+
+    def ReadPayload(self, LBA):
+        location = self.__locate(LBA)
+        if location is None:
+            track = self.__cuesheet.TrackAt(LBA)
+            return memoryview(bytes(self.__sectorlength(LBA, track)))
+        track, fileid, offset = location
+        return self.__streams[fileid].ReadAt(offset + track.PayloadOffset, self.__sectorlength(LBA, track))
+
+    def PayloadLengths(self, LBA, count):
+        end = min(LBA + count, len(self.__index))
+        lengths = np.zeros(max(end - LBA, 0), dtype=np.int64)
+        for track in self.__cuesheet.Tracks:
+            first = max(track.Start, LBA)
+            last = min(track.End, end)
+            if first >= last:
+                continue
+            if not track.IsData:
+                lengths[first - LBA:last - LBA] = track.SectorSize
+            elif not track.IsMode2:
+                lengths[first - LBA:last - LBA] = 2048
+            else:
+                form2 = (self.__index["submode"][first:last] & Submodes.Form.value) != 0
+                lengths[first - LBA:last - LBA] = np.where(form2, 2324, 2048)
+        return lengths
+
+    def ReadPayloads(self, lbas):
+        # consecutive stored sectors of one track are fetched with a single read
+        lbas = np.asarray(lbas, dtype=np.int64)
+        if len(lbas) == 0:
+            return
+        if lbas.min() < 0 or lbas.max() >= len(self.__index):
+            raise IndexError("LBA outside of the image")
+        streams = self.__index["streamid"][lbas]
+        offsets = self.__index["offset"][lbas].astype(np.int64)
+        breaks = np.flatnonzero(
+            (np.diff(lbas) != 1) | (np.diff(streams) != 0) | (np.diff(offsets) != SECTOR_SIZE)
+        ) + 1
+        for run in np.split(np.arange(len(lbas)), breaks):
+            first = int(lbas[run[0]])
+            last = int(lbas[run[-1]])
+            track = self.__cuesheet.TrackAt(first)
+            if streams[run[0]] == VIRTUAL_STREAM or track is None or \
+               track is not self.__cuesheet.TrackAt(last) or track.SectorSize != SECTOR_SIZE:
+                for lba in range(first, last + 1):
+                    yield lba, self.ReadPayload(lba)
+                continue
+            block = self.__streams[int(streams[run[0]])].ReadAt(int(offsets[run[0]]), len(run) * SECTOR_SIZE)
+            for i, lba in enumerate(range(first, last + 1)):
+                start = i * SECTOR_SIZE + track.PayloadOffset
+                yield lba, block[start:start + self.__sectorlength(lba, track)]
+
+    def Prefetch(self, lbas, depth=8, chunksize=32) -> Prefetcher:
+        return Prefetcher(self, lbas, depth, chunksize)
 
     def Read(self, buffer, LBA, count):
         bytesread = 0
         lba = LBA
         while bytesread < count:
-            sector = self.__sectors[lba]
-            sectorlen = 2324 if (sector.Submode & Submodes.Form) else 2048
-            fs = self.__streams[sector.FileStreamId]
-            fs.Stream.seek(sector.FileStreamOffset + 24, 0)
-            sectordata = fs.Stream.read(sectorlen)
+            sectordata = self.ReadPayload(lba)
+            sectorlen = len(sectordata)
             if (count-bytesread) > sectorlen:
                 buffer[bytesread:bytesread+sectorlen] = sectordata
                 bytesread += sectorlen
@@ -93,27 +283,59 @@ class Imagestream():
         return bytesread
 
     def ReadSector(self, LBA) -> Sector:
-        sector = self.__sectors[LBA]
-        fs = self.__streams[sector.FileStreamId]
-        sectorlen = 2324 if (sector.Submode & Submodes.Form) else 2048
-        ecclen = 2352 - sectorlen - 24
-        fs.Stream.seek(sector.FileStreamOffset + 24, 0)
-        sector.Data = fs.Stream.read(sectorlen)
-        sector.ECC = fs.Stream.read(ecclen)
+        sector = self.GetSector(LBA)
+        if not sector.Modified:
+            self.__readbody(sector, LBA)
         return sector
 
+    def __readbody(self, sector, LBA):
+        location = self.__locate(LBA)
+        if location is None:
+            sector.Data = self.ReadPayload(LBA)
+            sector.ECC = memoryview(b"")
+            return
+        track, fileid, offset = location
+        sectorlen = self.__sectorlength(LBA, track)
+        start = track.PayloadOffset
+        body = self.__streams[fileid].ReadAt(offset + start, track.SectorSize - start)
+        sector.Data = body[:sectorlen]
+        sector.ECC = body[sectorlen:]
+
+    def Close(self):
+        for s in self.__streams:
+            s.Close()
+        # the track streams of a container share it, it is closed once here
+        if self.__container is not None:
+            self.__container.Close()
+            self.__container = None
+
+    def Changes(self):
+        # regenerated raw bytes of every modified sector, by stream and offset
+        changes = {}
+        for sector in self.__sectors.values():
+            if sector.Modified and sector.FileStreamId != VIRTUAL_STREAM:
+                data = sector.ToBytes()
+                if sector.Mode == 2:
+                    data = Regenerate(data)
+                changes.setdefault(sector.FileStreamId, []).append((sector.FileStreamOffset, bytes(data)))
+        for fileid in changes:
+            changes[fileid].sort(key=lambda c: c[0])
+        return changes
+
     def Write(self, path, name):
+        changes = self.Changes()
         outputstreams = []
         for i in range(len(self.__streams)):
             s = self.__streams[i]
-            filename = "{} (Track {:02}).bin".format(name, i+1)
-            of = {"filename": filename, "stream": open(os.path.join(path, filename), "wb")}
-            outputstreams.append(of)
-        for i in range(len(self.Sectors)):
-            if self.Sectors[i].Data is None:
-                self.Sectors[i] = self.ReadSector(i)
-            s = self.Sectors[i]
-            outputstreams[s.FileStreamId]["stream"].write(s.ToBytes())
+            filename = "{} (Track {:02}).bin".format(name, self.__cuesheet.Files[i].Tracks[0].Number)
+            with open(os.path.join(path, filename), "wb", buffering=0) as o:
+                position = 0
+                for offset, data in changes.get(i, []):
+                    s.CopyTo(o, position, offset - position)
+                    WriteAll(o, data)
+                    position = offset + len(data)
+                s.CopyTo(o, position, s.Length - position)
+            outputstreams.append({"filename": filename})
         self.__writecue(path, name, outputstreams)
 
     @property
@@ -122,7 +344,15 @@ class Imagestream():
 
     @property
     def Sectors(self):
-        return self.__sectors
+        return SectorTable(self)
+
+    @property
+    def Index(self):
+        return self.__index
+
+    @property
+    def CueSheet(self):
+        return self.__cuesheet
 
     @property
     def Length(self):
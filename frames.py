@@ -0,0 +1,32 @@
+import numpy as np
+
+# every 0x800 bytes of a frame start with a sector marker that is not scan data
+SECTOR_PAYLOAD = 0x800
+
+
+def AssembleScan(payloads):
+    if all(len(p) == SECTOR_PAYLOAD for p in payloads):
+        scan = np.empty((len(payloads), SECTOR_PAYLOAD - 1), dtype=np.uint8)
+        for i, p in enumerate(payloads):
+            scan[i] = np.frombuffer(p, dtype=np.uint8, offset=1)
+        return memoryview(scan.reshape(-1))
+    data = np.concatenate([np.frombuffer(p, dtype=np.uint8) for p in payloads])
+    keep = np.ones(len(data), dtype=bool)
+    keep[::SECTOR_PAYLOAD] = False
+    return memoryview(data[keep])
+
+
+class Frame():
+    def __init__(self, streamindex, frameindex, startlba, scandata):
+        self.StreamIndex = streamindex
+        self.FrameIndex = frameindex
+        self.StartLBA = startlba
+        self.ScanData = scandata
+
+    def __repr__(self):
+        return "<Frame {:03}/{:04} LBA {} Size {:04X}>".format(
+            self.StreamIndex,
+            self.FrameIndex,
+            self.StartLBA,
+            len(self.ScanData)
+        )
@@ -0,0 +1,112 @@
+import os
+import json
+import hashlib
+import zipfile
+import numpy as np
+from pathlib import Path
+from sector import SECTOR_INDEX
+
+CACHE_VERSION = 2
+FINGERPRINT_CHUNK = 0x10000
+
+
+def Fingerprint(filepath):
+    size = os.path.getsize(filepath)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(size.to_bytes(8, "little"))
+    with open(filepath, "rb") as f:
+        for offset in (0, (size // 2) - (FINGERPRINT_CHUNK // 2), size - FINGERPRINT_CHUNK):
+            f.seek(max(0, offset), 0)
+            digest.update(f.read(FINGERPRINT_CHUNK))
+    return digest.hexdigest()
+
+
+class IndexCache():
+    def __init__(self, cuepath):
+        p = Path(cuepath)
+        self.__cuepath = str(p)
+        # a container may sit next to the CUE it was packed from
+        self.__path = str(p.with_suffix(".idx.npz") if p.suffix == ".cue" else p.with_name(p.name + ".idx.npz"))
+        self.__loaded = False
+        self.Index = None
+        self.Sectors = {}
+
+    def __key(self, trackpaths):
+        files = [self.__cuepath] + list(trackpaths)
+        key = []
+        for f in files:
+            st = os.stat(f)
+            key.append({
+                "filename": os.path.basename(f),
+                "size": st.st_size,
+                "mtime": st.st_mtime_ns,
+                "fingerprint": Fingerprint(f)
+            })
+        return {"version": CACHE_VERSION, "files": key}
+
+    def Load(self, trackpaths):
+        self.__loaded = False
+        if not os.path.exists(self.__path):
+            return False
+        try:
+            with np.load(self.__path, allow_pickle=False) as cache:
+                meta = json.loads(str(cache["meta"]))
+                if meta != self.__key(trackpaths):
+                    return False
+                index = cache["index"]
+                lbas = cache["lbas"].tolist()
+                offsets = cache["offsets"].tolist()
+                data = cache["data"].tobytes()
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            # a truncated or damaged cache is rebuilt like a stale one
+            return False
+        if index.dtype != SECTOR_INDEX:
+            return False
+        self.Index = index
+        self.Sectors = {lba: data[offsets[i]:offsets[i + 1]] for i, lba in enumerate(lbas)}
+        self.__loaded = True
+        return True
+
+    def Save(self, trackpaths, index, sectors):
+        lbas = sorted(sectors)
+        offsets = [0]
+        for lba in lbas:
+            offsets.append(offsets[-1] + len(sectors[lba]))
+        data = b"".join(bytes(sectors[lba]) for lba in lbas)
+        meta = json.dumps(self.__key(trackpaths))
+        tmppath = self.__path + ".tmp"
+        try:
+            with open(tmppath, "wb") as f:
+                np.savez(
+                    f,
+                    meta=np.array(meta),
+                    index=index,
+                    lbas=np.array(lbas, dtype=np.uint32),
+                    offsets=np.array(offsets, dtype=np.uint64),
+                    data=np.frombuffer(data, dtype=np.uint8)
+                )
+            os.replace(tmppath, self.__path)
+        except OSError:
+            # the cache is only an accelerator, a read-only disc folder
+            # just means every start rescans the tracks
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            return False
+        self.Index = index
+        self.Sectors = dict(sectors)
+        return True
+
+    def Invalidate(self):
+        self.__loaded = False
+        self.Index = None
+        self.Sectors = {}
+        if os.path.exists(self.__path):
+            os.remove(self.__path)
+
+    @property
+    def Path(self):
+        return self.__path
+
+    @property
+    def Loaded(self):
+        return self.__loaded
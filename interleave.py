@@ -0,0 +1,82 @@
+import numpy as np
+from sector import Submodes
+from isofile import BLOCK_SIZE
+
+EOR = Submodes.EOR.value
+VIDEO = Submodes.Video.value
+AUDIO = Submodes.Audio.value
+DATA = Submodes.Data.value
+EOF = Submodes.EOF.value
+
+
+class InterleaveStream():
+    def __init__(self, lbas, submodes, codings):
+        self.LBAs = lbas
+        self.Submodes = submodes
+        self.Codings = codings
+        audio = (submodes & AUDIO) != 0
+        eor = (submodes & EOR) != 0
+        self.Audio = lbas[audio]
+        self.NonAudio = lbas[~audio]
+        self.Video = lbas[(submodes & VIDEO) != 0]
+        self.Data = lbas[(submodes & DATA) != 0]
+        self.EOR = lbas[eor]
+        self.AudioEOR = lbas[audio & eor]
+        self.NonAudioEOR = lbas[~audio & eor]
+        self.DataEOR = lbas[((submodes & DATA) != 0) & eor]
+        self.EOF = lbas[(submodes & EOF) != 0]
+
+    def AudioRecords(self):
+        # an audio clip runs up to and including the next audio sector flagged
+        # EOR; it is numbered by the Data+EOR sectors seen so far
+        counters = np.searchsorted(self.DataEOR, self.AudioEOR, side="right")
+        ends = np.searchsorted(self.Audio, self.AudioEOR, side="right")
+        start = 0
+        for counter, end in zip(counters.tolist(), ends.tolist()):
+            yield counter, self.Audio[start:end]
+            start = end
+
+    def Coding(self, lba):
+        return int(self.Codings[np.searchsorted(self.LBAs, lba)])
+
+    def VideoRecords(self):
+        ends = np.searchsorted(self.NonAudio, self.NonAudioEOR, side="right")
+        start = 0
+        for end in ends.tolist():
+            yield self.NonAudio[start:end]
+            start = end
+
+    def __len__(self):
+        return len(self.LBAs)
+
+
+class InterleaveIndex(InterleaveStream):
+    def __init__(self, index, record):
+        # the stream ends at its first EOF sector or with the file's own extent
+        start = record.ExtentLocation
+        sectors = -(-record.DataLength // BLOCK_SIZE)
+        submodes = index["submode"][start:start + sectors]
+        eof = np.flatnonzero(submodes & EOF)
+        end = start + (int(eof[0]) if len(eof) > 0 else len(submodes))
+        self.Start = start
+        self.End = end
+        lbas = np.arange(start, end)
+        super().__init__(lbas, index["submode"][start:end], index["coding"][start:end])
+        self.Streams = {}
+        keys = (index["filenumber"][start:end].astype(np.uint16) << 8) | index["channel"][start:end]
+        for key in np.unique(keys).tolist():
+            mask = keys == key
+            self.Streams[(key >> 8, key & 0xFF)] = InterleaveStream(lbas[mask], self.Submodes[mask], self.Codings[mask])
+
+    def Stream(self, filenumber, channel):
+        return self.Streams.get((filenumber, channel))
+
+    def __repr__(self):
+        return "<Interleave LBA {}-{} Audio {} Video {} Data {} Streams {}>".format(
+            self.Start,
+            self.End,
+            len(self.Audio),
+            len(self.Video),
+            len(self.Data),
+            sorted(self.Streams)
+        )
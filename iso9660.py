@@ -1,11 +1,21 @@
 import os
+import shutil
+import numpy as np
+from contextlib import closing
+from itertools import islice
 from enum import Enum, Flag, auto
 from filestream import Imagestream
-from sector import Submodes
-from adpcm import ADPCMBlock
-from struct import pack, unpack
+from isofile import ISOFile
+from indexcache import IndexCache
+from ecc import VerifyImage
+from container import Pack
+from interleave import InterleaveIndex
+from demux import Demux, AudioSink, VideoSink, FrameSink
+from frames import Frame, AssembleScan
+from patch import PatchTransaction
+from delta import WriteDelta, WriteBPS
+from struct import unpack
 from datetime import datetime, timezone, timedelta
-import wave
 
 
 class VolumeDescriptorType(Enum):
@@ -134,33 +144,73 @@ class PrimaryVolumeDescriptor(VolumeDescriptor):
 
 class DirectoryRecord():
     def __init__(self, data):
-        header = unpack("<BBIIII7sBBBHHBb", data[:34])
+        self.__data = bytes(data)
+        header = unpack("<BBIIII7sBBBHHBb", self.__data[:34])
         self.LengthDR = header[0]
         self.LengthAR = header[1]
         self.ExtentLocation = header[2]
         self.DataLength = header[4]
-        tempdate = unpack("BBBBBBb",header[6])
-        self.RecordingDate = None if tempdate[0] == 0 else \
-            datetime(
-            1900 + tempdate[0],
-            tempdate[1],
-            tempdate[2],
-            tempdate[3],
-            tempdate[4],
-            tempdate[5],
-            tzinfo=timezone(timedelta(minutes = tempdate[6] * 15))
-        )
+        self.__rawdate = header[6]
+        self.__recordingdate = None
         self.FileFlags = FileFlags(header[7])
         self.FileUnitSize = header[8]
         self.InterleaveGapSize = header[9]
         self.VolumeSequenceNumber = header[10]
         self.LengthFI = header[12]
-        self.FileIdentifier = ""
+        self.FileIdentifier = self.__readIdentifier()
         self.Children = []
-        self.GroupID = 0
-        self.XAFlags = XAFlags(0)
-        self.XAFileId = 0
-    
+        self.__xa = None
+
+    def __readIdentifier(self):
+        identifier = self.__data[33:33+self.LengthFI]
+        if identifier == b"\x00":
+            return "."
+        elif identifier == b"\x01":
+            return ".."
+        return identifier.decode().split(";")[0].rstrip()
+
+    def __readXA(self):
+        if self.__xa is None:
+            # even length identifiers are followed by a padding byte
+            pos = 33 + self.LengthFI + (1 - self.LengthFI % 2)
+            data = self.__data[pos:pos+14]
+            if data[6:8] == b"XA":
+                self.__xa = (unpack(">I", data[0:4])[0], XAFlags(unpack(">H", data[4:6])[0]), data[8])
+            else:
+                self.__xa = (0, XAFlags(0), 0)
+        return self.__xa
+
+    @property
+    def RecordingDate(self):
+        if self.__recordingdate is None and self.__rawdate[0] != 0:
+            tempdate = unpack("BBBBBBb", self.__rawdate)
+            self.__recordingdate = datetime(
+                1900 + tempdate[0],
+                tempdate[1],
+                tempdate[2],
+                tempdate[3],
+                tempdate[4],
+                tempdate[5],
+                tzinfo=timezone(timedelta(minutes = tempdate[6] * 15))
+            )
+        return self.__recordingdate
+
+    @property
+    def GroupID(self):
+        return self.__readXA()[0]
+
+    @property
+    def XAFlags(self):
+        return self.__readXA()[1]
+
+    @property
+    def XAFileId(self):
+        return self.__readXA()[2]
+
+    @property
+    def IsDirectory(self):
+        return bool(self.FileFlags & FileFlags.Directory)
+
     def __repr__(self):
         formatstring = "<File {} Size {:04X} Date {} {} {} XAFileId {}>"
         return formatstring.format(
@@ -174,179 +224,258 @@ class DirectoryRecord():
 
 
 class ISOImage():
-    def __init__(self, filepath):
-        self.__imagestream = Imagestream(filepath)
+    def __init__(self, filepath, usemmap=False, usecache=True, rebuildindex=False, prefetch=0, prefetchchunk=32):
+        self.__indexcache = IndexCache(filepath) if usecache else None
+        if self.__indexcache is not None and rebuildindex:
+            self.__indexcache.Invalidate()
+        self.__imagestream = Imagestream(filepath, usemmap, self.__indexcache)
+        self.__metadata = {}
+        self.__interleaves = {}
+        self.__prefetch = prefetch
+        self.__prefetchchunk = prefetchchunk
+        if self.__indexcache is not None and self.__indexcache.Loaded:
+            self.__metadata = dict(self.__indexcache.Sectors)
         self.__volumedescriptors = []
         self.__rootDirectory = None
-        self.__nbSectors = self.__imagestream.Length / 2352
+        self.__directories = {}
+        self.__pathtable = {}
+        self.__paths = None
+        self.__nbSectors = len(self.__imagestream.Index)
         self.__readVolumeDescriptors()
         if len(self.__volumedescriptors) > 1:
-            self.__readDirectoryRecord(self.__rootDirectory.ExtentLocation)
+            self.__readDirectory(self.__rootDirectory)
+            self.__pathtable = self.__readPathTable(self.__volumedescriptors[0])
+        self.__cachedsectors = len(self.__metadata)
+        if self.__indexcache is not None and not self.__indexcache.Loaded:
+            self.__saveCache()
+
+    def __saveCache(self):
+        self.__indexcache.Save(
+            [s.Filepath for s in self.__imagestream.Streams],
+            self.__imagestream.Index,
+            self.__metadata
+        )
+        self.__cachedsectors = len(self.__metadata)
+
+    def __readSectorData(self, sectorId):
+        # volume descriptors and directories are kept so the index cache
+        # can rebuild them without touching the tracks
+        data = self.__metadata.get(sectorId)
+        if data is None:
+            data = bytes(self.__imagestream.ReadSector(sectorId).Data)
+            self.__metadata[sectorId] = data
+        return data
     
     def __readVolumeDescriptors(self):
         sectorId = 16
-        sector = self.__imagestream.ReadSector(sectorId)
-        vd = VolumeDescriptor(sector.Data)
+        data = self.__readSectorData(sectorId)
+        vd = VolumeDescriptor(data)
         while vd.VolumeDescriptorType != VolumeDescriptorType.SetTerminator and \
               sectorId < self.__nbSectors:
             if vd.StandardIdentifier == "CD001":
                 if vd.VolumeDescriptorType == VolumeDescriptorType.Primary:
-                    pvd = PrimaryVolumeDescriptor(sector.Data)
+                    pvd = PrimaryVolumeDescriptor(data)
                     self.__volumedescriptors.append(pvd)
                     self.__rootDirectory = pvd.rootDirectoryRecord
             sectorId += 1
-            sector = self.__imagestream.ReadSector(sectorId)
-            vd = VolumeDescriptor(sector.Data)
+            data = self.__readSectorData(sectorId)
+            vd = VolumeDescriptor(data)
         if vd.StandardIdentifier == "CD001":
             self.__volumedescriptors.append(vd)
 
-    def __readDirectoryRecord(self, sectorId):
-        sector = self.__imagestream.ReadSector(sectorId)
+    def __readDirectory(self, record: DirectoryRecord):
+        children = self.__directories.get(record.ExtentLocation)
+        if children is not None:
+            record.Children = children
+            return children
+        children = []
+        sectorId = record.ExtentLocation
+        remaining = record.DataLength
+        while remaining > 0:
+            sectordata = self.__readSectorData(sectorId)
+            offset = 0
+            # records never cross a sector, the rest of it is zero padding
+            while offset < len(sectordata) and sectordata[offset] != 0:
+                length = sectordata[offset]
+                children.append(DirectoryRecord(sectordata[offset:offset+length]))
+                offset += length
+            sectorId += 1
+            remaining -= len(sectordata)
+        record.Children = children
+        self.__directories[record.ExtentLocation] = children
+        return children
+
+    def __readPathTable(self, pvd: PrimaryVolumeDescriptor):
+        size = pvd.pathTableSize
+        data = bytearray()
+        sectorId = pvd.locationPathTable
+        while len(data) < size:
+            data += self.__readSectorData(sectorId)
+            sectorId += 1
+        # directory numbers start at 1 with the root, parents always come first
+        entries = []
         offset = 0
-        while sector.Data[offset] != 0:
-            length = sector.Data[offset]
-            data = sector.Data[offset:offset+length]
-            dr = DirectoryRecord(data)
-            pos = 33
-            if dr.LengthFI > 1:
-                dr.FileIdentifier = data[pos:pos+dr.LengthFI-2].decode().rstrip()
+        while offset + 8 <= size and data[offset] != 0:
+            length = data[offset]
+            extent, parent = unpack("<IH", data[offset+2:offset+8])
+            name = data[offset+8:offset+8+length].decode()
+            if not entries:
+                path = ""
+            elif parent == 1:
+                path = name
             else:
-                if data[pos] == 0:
-                    dr.FileIdentifier = "."
-                elif data[pos] == 1:
-                    dr.FileIdentifier = ".."
-                else:
-                    dr.FileIdentifier = ""
-                pos -= 1
-            pos += dr.LengthFI + 1
-            if data[pos+6:pos+8].decode() == "XA":
-                dr.GroupID = unpack(">I",data[pos:pos+4])[0]
-                dr.XAFlags = XAFlags(unpack(">H", data[pos+4:pos+6])[0])
-                dr.XAFileId = data[pos+8]
-            self.__rootDirectory.Children.append(dr)
-            offset += length
-    
+                path = entries[parent - 1][0] + "/" + name
+            entries.append((path, extent))
+            offset += 8 + length + (length & 1)
+        return dict(entries)
+
+    def Walk(self, record: DirectoryRecord = None, path=""):
+        if record is None:
+            record = self.__rootDirectory
+        for child in self.__readDirectory(record):
+            if child.FileIdentifier in (".", ".."):
+                continue
+            childpath = child.FileIdentifier if not path else path + "/" + child.FileIdentifier
+            yield childpath, child
+            if child.IsDirectory:
+                yield from self.Walk(child, childpath)
+
+    def Directory(self, path):
+        # the path table gives the extent directly, only the directory itself is read
+        path = path.strip("/")
+        extent = self.__pathtable.get(path)
+        if extent is None:
+            raise KeyError(path)
+        children = self.__directories.get(extent)
+        if children is None:
+            first = DirectoryRecord(self.__readSectorData(extent)[:34])
+            self.__readDirectory(first)
+            children = first.Children
+        return children
+
+    def Find(self, path) -> DirectoryRecord:
+        path = path.strip("/")
+        if self.__paths is not None:
+            return self.__paths[path]
+        parent, _, name = path.rpartition("/")
+        for child in self.Directory(parent):
+            if child.FileIdentifier == name:
+                return child
+        raise KeyError(path)
+
+    def Open(self, record: DirectoryRecord) -> ISOFile:
+        return ISOFile(self.__imagestream, record.ExtentLocation, record.DataLength)
+
     def ReadFile(self, record: DirectoryRecord, destination=None):
-        size = record.DataLength
-        buffer = bytearray(size)
-        self.__imagestream.Read(buffer, record.ExtentLocation, size)
-        if destination is None:
-            return buffer
-        else:
+        with self.Open(record) as f:
+            if destination is None:
+                buffer = bytearray(record.DataLength)
+                f.readinto(buffer)
+                return buffer
             with open(destination,'wb') as o:
-                o.write(buffer)
+                shutil.copyfileobj(f, o)
 
-    def ReadAudio(self, record: DirectoryRecord, destination, limit=0):
-        sectorId = record.ExtentLocation
-        filecounter = 0
-        prev1 = 0
-        prev2 = 0
-        pcms = []
-        sh = self.__imagestream.Sectors[sectorId]
-        while not (sh.Submode & Submodes.EOF):
-            if (sh.Submode & Submodes.Data and sh.Submode & Submodes.EOR):
-                filecounter += 1
-            if (sh.Submode & Submodes.Audio):
-                s = self.__imagestream.ReadSector(sectorId)
-                for sg in range(18):
-                    data = s.Data[sg * 128:(sg * 128) + 128]
-                    block = ADPCMBlock(data)
-                    result,prev1,prev2 = block.ReadPCM(prev1, prev2) 
-                    pcms.extend(result)
-                if (sh.Submode & Submodes.EOR):
-                    filename = os.path.join(destination, "audio_{:03}.wav".format(filecounter))
-                    if not os.path.exists(os.path.dirname(filename)):
-                        os.makedirs(os.path.dirname(filename), exist_ok=True)
-                    wavefile = wave.open(filename, "wb")
-                    wavefile.setparams((1, 2, 44100, len(pcms),"NONE","not compressed"))
-                    frames = pack(str(len(pcms)) + "h", *pcms)
-                    wavefile.writeframes(frames)
-                    wavefile.close()
-                    pcms = []
-                    prev1 = 0
-                    prev2 = 0
-                    if limit > 0 and filecounter >= limit:
-                        break
-            sectorId +=1
-            sh = self.__imagestream.Sectors[sectorId]
+    def Interleave(self, record: DirectoryRecord) -> InterleaveIndex:
+        key = (record.ExtentLocation, record.DataLength)
+        interleave = self.__interleaves.get(key)
+        if interleave is None:
+            interleave = InterleaveIndex(self.__imagestream.Index, record)
+            self.__interleaves[key] = interleave
+        return interleave
 
-    def ReadVideo(self, record: DirectoryRecord, destination, limit=0):
-        sectorId = record.ExtentLocation
-        filecounter = 0
-        bytes = bytearray()
-        sh = self.__imagestream.Sectors[sectorId]
-        while not (sh.Submode & Submodes.EOF):
-            if not (sh.Submode & Submodes.Audio):
-                s = self.__imagestream.ReadSector(sectorId)
-                bytes += s.Data
-                if (sh.Submode & Submodes.EOR):
-                    filename = os.path.join(destination, "video_{:03}.bin".format(filecounter))
-                    if not os.path.exists(os.path.dirname(filename)):
-                        os.mkdir(os.path.dirname(filename))
-                    with open(filename, "wb") as o:
-                        o.write(bytes)
-                        bytes = bytearray()
-                        filecounter += 1
-                        if limit > 0 and filecounter >= limit:
-                            break
-            sectorId += 1
-            sh = self.__imagestream.Sectors[sectorId]
+    def __readPayloads(self, records):
+        # a single reader spans every record so read-ahead carries over
+        lbas = np.concatenate(records) if records else np.empty(0, dtype=np.int64)
+        if self.__prefetch > 0:
+            return self.__imagestream.Prefetch(lbas, self.__prefetch, self.__prefetchchunk)
+        return closing(self.__imagestream.ReadPayloads(lbas))
 
+    def Extract(self, record: DirectoryRecord, sinks):
+        # every sector of the file is read once and handed to each sink wanting it
+        Demux(self.Interleave(record), sinks, self.__readPayloads)
+
+    def ReadAudio(self, record: DirectoryRecord, destination, limit=0, native=False):
+        self.Extract(record, [AudioSink(destination, limit, native=native)])
+
+    def ReadVideo(self, record: DirectoryRecord, destination, limit=0):
+        self.Extract(record, [VideoSink(destination, limit)])
 
     def ReadVideoFrames(self, record: DirectoryRecord, destination, limit=0):
-        sectorId = record.ExtentLocation
-        filecounter = 0
-        framecounter = 0
-        bytes = bytearray()
-        sh = self.__imagestream.Sectors[sectorId]
-        while not (sh.Submode & Submodes.EOF):
-            if not (sh.Submode & Submodes.Audio):
-                s = self.__imagestream.ReadSector(sectorId)
-                if s.Data[0] == 0xF3:
-                    pass
-                elif s.Data[0] == 0xF2:
-                    bytes += s.Data
-                    filename = os.path.join(destination, "{:03}/frame_{:04}.bin".format(filecounter, framecounter))
-                    if not os.path.exists(os.path.dirname(filename)):
-                        os.makedirs(os.path.dirname(filename),exist_ok=True)
-                    with open(filename, "wb") as o:
-                        o.write(bytes)
-                    bytes = bytearray()
-                    framecounter += 1
-                else:
-                    bytes += s.Data
-                if (sh.Submode & Submodes.EOR):
-                    filecounter += 1
-                    framecounter = 0
-                    if limit > 0 and filecounter >= limit:
-                        break
-            sectorId += 1
-            sh = self.__imagestream.Sectors[sectorId]
+        self.Extract(record, [FrameSink(destination, limit)])
+
+    def IterFrames(self, record: DirectoryRecord, limit=0):
+        # same frames as ReadVideoFrames, kept in memory instead of written out
+        records = list(self.Interleave(record).VideoRecords())
+        with self.__readPayloads(records) as payloads:
+            payloads = iter(payloads)
+            sectors = []
+            for streamindex, lbas in enumerate(records):
+                frameindex = 0
+                for sectorId, payload in islice(payloads, len(lbas)):
+                    if payload[0] == 0xF3:
+                        continue
+                    sectors.append((sectorId, payload))
+                    if payload[0] == 0xF2:
+                        yield Frame(streamindex, frameindex, sectors[0][0], AssembleScan([p for _, p in sectors]))
+                        sectors = []
+                        frameindex += 1
+                if limit > 0 and streamindex + 1 >= limit:
+                    break
+
+    def PatchFrames(self, patches=()) -> PatchTransaction:
+        # patches are (sectorId, data, offset) tuples applied in order as one
+        # transaction, with no patches the transaction is handed back to fill
+        transaction = PatchTransaction(self.__imagestream)
+        for patch in patches:
+            transaction.Add(*patch)
+        if transaction.Patches:
+            transaction.Commit()
+        return transaction
 
     def PatchFrame(self, sectorId, data, offset=0x28):
-        o = offset
-        sid = sectorId
-        shiftdata = data
-        s = self.__imagestream.ReadSector(sectorId)
-        fid = s.FileStreamId
-        while s.Data[0] != 0xF2:
-            if not(s.Submode & Submodes.Audio) and s.Data[0] == 0xF1:
-                shiftdata = s.insertData(shiftdata, o)
-                o = 1
-            sid += 1
-            # skip audio sectors
-            while (self.__imagestream.Sectors[sid].Submode & Submodes.Audio):
-                sid +=1
-            s = self.__imagestream.ReadSector(sid)
-        s.insertData(shiftdata, 0x23) ## supposed end of F2 header, ignored popped values that are probably FF
-        
+        self.PatchFrames([(sectorId, data, offset)])
+
     def Write(self, path, name):
         self.__imagestream.Write(path, name)
 
+    def WriteDelta(self, filepath):
+        return WriteDelta(self.__imagestream, filepath)
+
+    def WriteBPS(self, path, name):
+        # one patch per track file that has modified sectors
+        filepaths = []
+        for fileid, changes in sorted(self.__imagestream.Changes().items()):
+            number = self.__imagestream.CueSheet.Files[fileid].Tracks[0].Number
+            filepath = os.path.join(path, "{} (Track {:02}).bps".format(name, number))
+            WriteBPS(self.__imagestream.Streams[fileid], changes, filepath)
+            filepaths.append(filepath)
+        return filepaths
+
+    def Pack(self, destination, compression="zlib"):
+        Pack(self.__imagestream, destination, compression)
+
+    def Verify(self, workers=None):
+        return VerifyImage(self.__imagestream, workers)
+
+    def Close(self):
+        if self.__indexcache is not None and len(self.__metadata) > self.__cachedsectors:
+            self.__saveCache()
+        self.__imagestream.Close()
+
     @property
     def VolumeDescriptors(self):
         return self.__volumedescriptors
 
+    @property
+    def Root(self):
+        return self.__rootDirectory
+
+    @property
+    def Paths(self):
+        if self.__paths is None:
+            self.__paths = dict(self.Walk())
+        return self.__paths
+
     @property
     def Files(self):
-        return [f for f in self.__rootDirectory.Children if not (f.FileFlags & FileFlags.Directory)]
+        return [f for f in self.__rootDirectory.Children if not f.IsDirectory]
@@ -0,0 +1,75 @@
+import io
+import numpy as np
+
+# the directory size counts 2048-byte logical blocks, Form 2 or not
+BLOCK_SIZE = 2048
+
+
+class ISOFile(io.RawIOBase):
+    def __init__(self, imagestream, extent, size):
+        super().__init__()
+        self.__imagestream = imagestream
+        self.__extent = extent
+        self.__size = size
+        self.__position = 0
+        self.__ends = None
+
+    def __layout(self):
+        # payload end offsets of the file's sectors, looked up once on the
+        # first read since Form 2 sectors carry more bytes than the blocks
+        if self.__ends is None:
+            count = -(-self.__size // BLOCK_SIZE)
+            self.__ends = np.cumsum(self.__imagestream.PayloadLengths(self.__extent, count), dtype=np.int64)
+        return self.__ends
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        self._checkClosed()
+        view = memoryview(buffer).cast("B")
+        count = min(len(view), self.__size - self.__position)
+        done = 0
+        ends = self.__layout()
+        while done < count:
+            sector = int(np.searchsorted(ends, self.__position, side="right"))
+            if sector >= len(ends):
+                break
+            start = int(ends[sector - 1]) if sector > 0 else 0
+            payload = self.__imagestream.ReadPayload(self.__extent + sector)
+            offset = self.__position - start
+            length = min(len(payload) - offset, count - done)
+            view[done:done + length] = payload[offset:offset + length]
+            done += length
+            self.__position += length
+        return done
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._checkClosed()
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.__position + offset
+        elif whence == io.SEEK_END:
+            position = self.__size + offset
+        else:
+            raise ValueError("invalid whence ({})".format(whence))
+        if position < 0:
+            raise ValueError("negative seek position {}".format(position))
+        self.__position = position
+        return position
+
+    def tell(self):
+        self._checkClosed()
+        return self.__position
+
+    @property
+    def Extent(self):
+        return self.__extent
+
+    @property
+    def Size(self):
+        return self.__size
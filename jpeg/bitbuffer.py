@@ -1,70 +1,154 @@
 from struct import unpack
+import numpy as np
+
+# bytes pulled into the accumulator per refill
+REFILL_BYTES = 8
+MARKERS = (0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD9)
 
 class BitBuffer:
+    # reads go through an accumulator over the data with the FF00 stuffing
+    # already removed; index and pos still refer to the raw bytes
     def __init__(self, values=None):
         self.__values = bytearray() if values is None else values
-        self.__buffer = 0
-        self.pos = 0
-        self.index = 0
+        self.__pending = 0
+        self.__pendingbits = 0
+        self.__data = None
+        self.__rawindex = None
+        self.__markers = None
+        self.__acc = 0
+        self.__bits = 0
+        self.__next = 0
+
+    def __prepare(self):
+        raw = np.frombuffer(bytes(self.__values), dtype=np.uint8)
+        stuffed = np.zeros(len(raw), dtype=bool)
+        stuffed[1:] = (raw[1:] == 0x00) & (raw[:-1] == 0xFF)
+        kept = np.flatnonzero(~stuffed)
+        self.__data = raw[kept].tobytes()
+        self.__rawindex = np.append(kept, len(raw))
+        self.__markers = np.flatnonzero((raw[:-1] == 0xFF) & np.isin(raw[1:], MARKERS))
+        self.__acc = 0
+        self.__bits = 0
+        self.__next = 0
+
+    def __position(self):
+        if self.__data is None:
+            self.__prepare()
+        return self.__next * 8 - self.__bits
+
+    def __seek(self, position):
+        if self.__data is None:
+            self.__prepare()
+        self.__next = position >> 3
+        self.__acc = 0
+        self.__bits = 0
+        skip = position & 7
+        if skip and self.__next < len(self.__data):
+            self.__acc = self.__data[self.__next] & (0xFF >> skip)
+            self.__bits = 8 - skip
+            self.__next += 1
+        else:
+            # past the end nothing can be loaded, the position is kept as is
+            self.__bits = -skip
 
     def push(self, bit):
-        self.__buffer <<= 1
-        self.__buffer |= bit
-        self.pos += 1
-        if self.pos == 8:
-            self.__values.append(self.__buffer)
-            if self.__buffer == 0xFF:
+        self.__pending <<= 1
+        self.__pending |= bit
+        self.__pendingbits += 1
+        if self.__pendingbits == 8:
+            self.__values.append(self.__pending)
+            if self.__pending == 0xFF:
                 self.__values.append(0x00)
-            self.__buffer = 0
-            self.pos = 0
-    
-    def pop(self):
-        self.__buffer = (self.__values[self.index] >> (7 - (self.pos)))
-        self.pos += 1
-        if self.pos > 7:
-            self.pos = 0
-            if self.index < len(self.__values):
-                self.index += 1
-                if self.__values[self.index -1] == 0xFF and self.__values[self.index] == 0x00:
-                    self.index += 1
-            else:
+            self.__pending = 0
+            self.__pendingbits = 0
+            self.__data = None
+
+    def peek(self, nbbits):
+        # the next nbbits without moving, None when the data ends first
+        if self.__bits < nbbits:
+            if self.__data is None:
+                self.__prepare()
+            count = max(REFILL_BYTES, (nbbits - self.__bits + 7) >> 3)
+            chunk = self.__data[self.__next:self.__next + count]
+            self.__acc = (self.__acc << (len(chunk) * 8)) | int.from_bytes(chunk, "big")
+            self.__bits += len(chunk) * 8
+            self.__next += len(chunk)
+            if self.__bits < nbbits:
                 return None
-        return self.__buffer & 0x01
+        return self.__acc >> (self.__bits - nbbits)
+
+    def consume(self, nbbits):
+        if self.__bits < nbbits:
+            self.__seek(self.__position() + nbbits)
+            return
+        self.__bits -= nbbits
+        self.__acc &= (1 << self.__bits) - 1
+
+    def pop(self):
+        bit = self.peek(1)
+        if bit is not None:
+            self.consume(1)
+        return bit
 
     def readbits(self, nbbits):
-        val = 0
-        for _ in range(nbbits):
-            b = self.pop()
-            if b is None:
-                return None
-            val <<= 1
-            val |= b
+        val = self.peek(nbbits)
+        if val is not None:
+            self.consume(nbbits)
         return val
 
     def readint16(self):
-        data = self.__values[self.index:self.index + 2]
+        index = self.index
+        data = self.__values[index:index + 2]
         val = unpack(">H", data)[0]
-        self.index += 2
+        self.index = index + 2
         return val
 
     def gotonextbyte(self):
         if self.pos != 0:
-            self.pos = 0
-            self.index += 1
+            self.__seek((self.__position() >> 3) * 8 + 8)
+
+    @property
+    def index(self):
+        position = self.__position()
+        return int(self.__rawindex[min(position >> 3, len(self.__rawindex) - 1)])
+
+    @index.setter
+    def index(self, value):
+        if self.__data is None:
+            self.__prepare()
+        byte = int(np.searchsorted(self.__rawindex, value))
+        self.__seek(byte * 8 + (self.__position() & 7))
+
+    @property
+    def pos(self):
+        return self.__position() & 7
+
+    @pos.setter
+    def pos(self, value):
+        self.__seek((self.__position() & ~7) | value)
+
+    @property
+    def Markers(self):
+        # raw offsets of the RSTn and EOI markers in the data
+        if self.__data is None:
+            self.__prepare()
+        return self.__markers
 
     @property
     def EOF(self):
-        return self.index >= len(self.__values)
-    
+        return self.__position() >= len(self.__data) * 8
+
     @property
     def Values(self):
         values = self.__values
-        if self.pos > 0:
-            buffer = self.__buffer << (8 - self.pos)
+        if self.__pendingbits > 0:
+            buffer = self.__pending << (8 - self.__pendingbits)
             # buffer |= (0xff >> self.__pos)
             values.append(buffer)
+            self.__data = None
         return values
 
     @Values.setter
     def Values(self, value):
-        self.__values = value
\ No newline at end of file
+        self.__values = value
+        self.__data = None
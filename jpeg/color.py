@@ -0,0 +1,55 @@
+from enum import Enum
+from jpeg.idct import FIX_PRECISION, FLOAT2FIX
+import numpy as np
+
+FIX_CR_R = FLOAT2FIX(1.402)
+FIX_CB_G = FLOAT2FIX(0.34414)
+FIX_CR_G = FLOAT2FIX(0.71414)
+FIX_CB_B = FLOAT2FIX(1.772)
+FIX_OFFSET = 128 << FIX_PRECISION
+
+class ChromaMode(Enum):
+    NEAREST = 0x00
+    SMOOTH = 0x01
+
+def _nearest(buffer, rows, cols):
+    # flat offsets like the per-pixel loop used, a column past the stride
+    # runs into the next row exactly as it did there
+    return buffer.buffer[(rows * buffer.stride)[:, None] + cols[None, :]]
+
+def _axis(length, factor, maximum, size):
+    # neighbouring samples and weights around each output sample centre
+    position = np.clip((np.arange(length) + 0.5) * factor / maximum - 0.5, 0, size - 1)
+    first = np.floor(position).astype(np.int64)
+    return first, np.minimum(first + 1, size - 1), position - first
+
+def _smooth(buffer, height, width, factorv, factorh, maxv, maxh):
+    # bilinear between the sample centres, clamped at the plane edges
+    plane = buffer.Plane
+    y0, y1, fy = _axis(height, factorv, maxv, buffer.height)
+    x0, x1, fx = _axis(width, factorh, maxh, buffer.stride)
+    top = plane[y0][:, x0] * (1 - fx) + plane[y0][:, x1] * fx
+    bottom = plane[y1][:, x0] * (1 - fx) + plane[y1][:, x1] * fx
+    return np.floor(top * (1 - fy)[:, None] + bottom * fy[:, None]).astype(np.int64)
+
+def Upsample(buffer, component, sof, mode=ChromaMode.NEAREST):
+    maxv = sof.MaxV
+    maxh = sof.MaxH
+    if mode == ChromaMode.SMOOTH:
+        return _smooth(buffer, sof.Height, sof.Width, component.SamplingFactorV, component.SamplingFactorH, maxv, maxh)
+    rows = np.arange(sof.Height, dtype=np.int64) * component.SamplingFactorV // maxv
+    cols = np.arange(sof.Width, dtype=np.int64) * component.SamplingFactorH // maxh
+    return _nearest(buffer, rows, cols)
+
+def YCbCrToRGB(buffers, sof, mode=ChromaMode.NEAREST, out=None):
+    # fixed-point conversion of the decoded planes into an (H, W, 3) uint8 image
+    if out is None:
+        out = np.empty((sof.Height, sof.Width, 3), dtype=np.uint8)
+    # luma is read at the pixel position whatever its sampling factors
+    Y = _nearest(buffers['Y'], np.arange(sof.Height, dtype=np.int64), np.arange(sof.Width, dtype=np.int64)) + FIX_OFFSET
+    Cb = Upsample(buffers['Cb'], sof.Components['Cb'], sof, mode)
+    Cr = Upsample(buffers['Cr'], sof.Components['Cr'], sof, mode)
+    out[..., 0] = np.clip((Y + (FIX_CR_R * Cr >> FIX_PRECISION)) >> FIX_PRECISION, 0, 255)
+    out[..., 1] = np.clip((Y - (FIX_CB_G * Cb >> FIX_PRECISION) - (FIX_CR_G * Cr >> FIX_PRECISION)) >> FIX_PRECISION, 0, 255)
+    out[..., 2] = np.clip((Y + (FIX_CB_B * Cb >> FIX_PRECISION)) >> FIX_PRECISION, 0, 255)
+    return out
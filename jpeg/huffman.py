@@ -4,6 +4,9 @@ from jpeg.bitbuffer import BitBuffer
 import os
 from enum import Enum
 
+# codes up to this length resolve with one peek, longer ones per length
+LOOKUP_BITS = 9
+
 class HuffmanTableType(Enum):
     DC = 0x00
     AC = 0x01
@@ -39,6 +42,9 @@ class Huffman:
         self.root = None
         self.codes = {}
         self.reverse_codes = {}
+        self.lookup = None
+        self.longcodes = {}
+        self.maxlength = 0
         if bytes is not None:
             self.FromBytes(bytes)
         elif dict is not None:
@@ -67,6 +73,7 @@ class Huffman:
         self.root = heap[0]
         code = ""
         self.__traversetree(self.root, code)
+        self.__compile()
 
     def FromBytes(self, bytes):
         self.bytesread = 0
@@ -102,6 +109,7 @@ class Huffman:
                         node.right = HuffmanNode()
                     node = node.right
             node.value = v
+        self.__compile()
 
     def FromDict(self, dict):
         self.Id = dict["Id"]
@@ -120,6 +128,7 @@ class Huffman:
                         node.right = HuffmanNode()
                     node = node.right
             node.value = entry["value"]
+        self.__compile()
 
     def ToDict(self):
         self.__traversetree(self.root, "")
@@ -129,6 +138,29 @@ class Huffman:
             "Table": [{"len":len(k), "code": int(k,2), "binary": k, "value": v, "hex": "{:02X}".format(v)} for k, v in self.reverse_codes.items()]
         }
 
+    def __compile(self):
+        # canonical lookup tables built from the tree; entries left as None
+        # are not valid code prefixes and go through the tree walk instead
+        self.lookup = None
+        self.longcodes = {}
+        self.maxlength = 0
+        if self.root is None or self.root.IsLeaf():
+            return
+        self.codes = {}
+        self.reverse_codes = {}
+        self.__traversetree(self.root, "")
+        lookup = [None] * (1 << LOOKUP_BITS)
+        for code, value in self.reverse_codes.items():
+            length = len(code)
+            self.maxlength = max(self.maxlength, length)
+            if length > LOOKUP_BITS:
+                self.longcodes[(length, int(code, 2))] = value
+                continue
+            start = int(code, 2) << (LOOKUP_BITS - length)
+            for i in range(start, start + (1 << (LOOKUP_BITS - length))):
+                lookup[i] = (value, length)
+        self.lookup = lookup
+
     def __traversetree(self, node, code):
         if node is None:
             return
@@ -159,14 +191,38 @@ class Huffman:
             val = self.DecodeChar(buffer)
         return decvals
     
-    def DecodeChar(self, buffer):
+    def DecodeChar(self, buffer, trace=False):
+        # the code string is only built when tracing
+        if self.lookup is not None:
+            bits = buffer.peek(LOOKUP_BITS)
+            if bits is not None:
+                entry = self.lookup[bits]
+                if entry is not None:
+                    value, length = entry
+                    buffer.consume(length)
+                    code = "{:0{}b}".format(bits >> (LOOKUP_BITS - length), length) if trace else None
+                    return None if value == 0xFF else value, code
+                for length in range(LOOKUP_BITS + 1, self.maxlength + 1):
+                    bits = buffer.peek(length)
+                    if bits is None:
+                        break
+                    value = self.longcodes.get((length, bits))
+                    if value is not None:
+                        buffer.consume(length)
+                        code = "{:0{}b}".format(bits, length) if trace else None
+                        return None if value == 0xFF else value, code
+        return self.__walk(buffer, trace)
+
+    def __walk(self, buffer, trace):
+        # bit by bit, for the end of the data and invalid codes
         node = self.root
         code = ""
         while node is not None and not node.IsLeaf() and not buffer.EOF:
             b = buffer.pop()
-            code += str(b)
+            if trace:
+                code += str(b)
             node = node.left if b == 0 else node.right
-        return None if node is None or node.value == 0xFF else node.value, code
+        return None if node is None or node.value == 0xFF else node.value, code if trace else None
 
     
     def DrawTree(self, parent=None, graph=None, code = "", filename="test.gv"):
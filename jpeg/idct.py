@@ -1,6 +1,6 @@
 from math import cos, pi, sqrt
-
-from sqlalchemy import table
+from enum import Enum
+import numpy as np
 
 FIX_PRECISION = 11
 FLOAT2FIX = lambda x: int(x * (1 << FIX_PRECISION))
@@ -17,6 +17,51 @@ AAN_DCT_FACTOR = [
 
 DCT_SIZE = 8
 
+# A[u][x] = c(u) / 2 * cos((2x + 1) * u * pi / 16), the exact float transform
+IDCT_BASIS = np.array([
+    [(sqrt(0.5) if u == 0 else 1.0) / 2 * cos((2 * x + 1) * u * pi / 16) for x in range(DCT_SIZE)]
+    for u in range(DCT_SIZE)
+])
+
+class IDCTMode(Enum):
+    FIXED = 0x00
+    FLOAT = 0x01
+
+def IDCTPass(data):
+    # idctpass along the last axis of an int64 array, same fixed-point steps
+    tmp0 = data[..., 0]
+    tmp1 = data[..., 2]
+    tmp2 = data[..., 4]
+    tmp3 = data[..., 6]
+    tmp10 = tmp0 + tmp2
+    tmp11 = tmp0 - tmp2
+    tmp13 = tmp1 + tmp3
+    tmp12 = ((tmp1 - tmp3) * FIX_2COS_PI_4_16 >> FIX_PRECISION) - tmp13
+    tmp0 = tmp10 + tmp13
+    tmp3 = tmp10 - tmp13
+    tmp1 = tmp11 + tmp12
+    tmp2 = tmp11 - tmp12
+    tmp4 = data[..., 1]
+    tmp5 = data[..., 3]
+    tmp6 = data[..., 5]
+    tmp7 = data[..., 7]
+    z13 = tmp6 + tmp5
+    z10 = tmp6 - tmp5
+    z11 = tmp4 + tmp7
+    z12 = tmp4 - tmp7
+    tmp7 = z11 + z13
+    tmp11 = (z11 - z13) * FIX_2COS_PI_4_16 >> FIX_PRECISION
+    z5 = (z10 + z12) * FIX_2COS_PI_2_16 >> FIX_PRECISION
+    tmp10 = (FIX_1COS_PI_2_16 * z12 >> FIX_PRECISION) - z5
+    tmp12 = (FIX_1COS_PI_6_16 * z10 >> FIX_PRECISION) + z5
+    tmp6 = tmp12 - tmp7
+    tmp5 = tmp11 - tmp6
+    tmp4 = tmp10 + tmp5
+    return np.stack((
+        tmp0 + tmp7, tmp1 + tmp6, tmp2 + tmp5, tmp3 - tmp4,
+        tmp3 + tmp4, tmp2 - tmp5, tmp1 - tmp6, tmp0 - tmp7
+    ), axis=-1)
+
 class IDCT:
     def __init__(self, qtab):
         self.factor = [0.0] * 64
@@ -26,6 +71,18 @@ class IDCT:
                 self.factor[i * 8 + j] = 1.0 * (AAN_DCT_FACTOR[i] * AAN_DCT_FACTOR[j] / 8)
         for i in range(64):
             self.qtab[i] = FLOAT2FIX(self.factor[i] * qtab[i])
+        self.QTab = np.array(self.qtab, dtype=np.int64).reshape(DCT_SIZE, DCT_SIZE)
+        self.Quantization = np.array(list(qtab), dtype=np.float64).reshape(DCT_SIZE, DCT_SIZE)
+
+    def Transform(self, coefficients, mode=IDCTMode.FIXED):
+        # (N, 8, 8) quantized coefficients in natural order to (N, 8, 8)
+        # samples scaled by 1 << FIX_PRECISION like idct2d8x8
+        blocks = np.asarray(coefficients).reshape(-1, DCT_SIZE, DCT_SIZE)
+        if mode == IDCTMode.FLOAT:
+            data = IDCT_BASIS.T @ (blocks * self.Quantization) @ IDCT_BASIS
+            return np.floor(data * (1 << FIX_PRECISION)).astype(np.int64)
+        data = IDCTPass(blocks.astype(np.int64) * self.QTab)
+        return IDCTPass(data.swapaxes(-1, -2)).swapaxes(-1, -2)
 
     def idctpass(self, data, colskip, rowskip):
         index = 0
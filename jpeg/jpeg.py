@@ -1,18 +1,16 @@
 from enum import Enum
 from struct import unpack
 from jpeg.bitbuffer import BitBuffer
-from jpeg.idct import FIX_PRECISION, FLOAT2FIX
+from jpeg.idct import FIX_PRECISION, IDCTMode
 from jpeg.quantization import QuantizationTable, QuantizationType
 from jpeg.huffman import Huffman, HuffmanTableType
 from jpeg.frame import StartOfFrame, FrameComponent
 from jpeg.scan import StartOfScan, ScanComponent
+from jpeg.color import ChromaMode, YCbCrToRGB
 from PIL import Image
-import logging
+import numpy as np
 import os
 
-def clamp(val, minval, maxval):
-    return max(minval,min(maxval,val))
-
 class JPEGDensityUnit(Enum):
     NONE = 0x00
     INCH = 0x01
@@ -124,7 +122,17 @@ class YUVBuffer:
     def __init__(self, stride, height):
         self.stride = stride
         self.height = height
-        self.buffer = [0] * (stride * height)
+        self.buffer = np.zeros(stride * height, dtype=np.int64)
+
+    def StoreBlocks(self, offsets, blocks):
+        # 8x8 blocks at flat offsets, rows stride apart
+        rows = np.arange(8) * self.stride
+        indexes = np.asarray(offsets, dtype=np.int64)[:, None, None] + rows[None, :, None] + np.arange(8)[None, None, :]
+        self.buffer[indexes] = np.asarray(blocks).reshape(-1, 8, 8)
+
+    @property
+    def Plane(self):
+        return self.buffer.reshape(self.height, self.stride)
 class JFIFFile():
     def __init__(self, filename=None, dict=None):
         self.__app = None
@@ -242,16 +250,19 @@ class JFIFFile():
             "SOS": self.__sos.ToDict()
         }
 
-    def Decode(self, buffer, filename=None):
-        outputfolder = os.path.dirname(filename)
-        if not os.path.exists(outputfolder):
-            os.makedirs(outputfolder, exist_ok=True)
-        log = logging.getLogger()
-        log.setLevel(logging.DEBUG)
-        logpath = filename.replace(".png",".log")
-        filelog = logging.FileHandler(logpath, "w", encoding="utf-8")
-        filelog.setLevel(logging.DEBUG)
-        log.addHandler(filelog)
+    def Decode(self, buffer, filename=None, tracer=None, idctmode=IDCTMode.FIXED, chromamode=ChromaMode.NEAREST):
+        # raw scan bytes, e.g. Frame.ScanData, are read through a BitBuffer;
+        # a jpeg.trace.Tracer records every symbol and block when given.
+        # blocks are entropy decoded first and transformed per component in
+        # one batch, a trace needs each block as it goes so it skips batching
+        if not isinstance(buffer, BitBuffer):
+            buffer = BitBuffer(buffer)
+        if filename is not None:
+            outputfolder = os.path.dirname(filename)
+            if outputfolder and not os.path.exists(outputfolder):
+                os.makedirs(outputfolder, exist_ok=True)
+        trace = tracer is not None
+        unsignedAC = "0"
         prevDCs = {t: 0 for t in self.__sos.Components}
         sof = self.__sof
         sos = self.__sos
@@ -263,26 +274,29 @@ class JFIFFile():
             stride = int(self.__sof.AlignedWidth * c.SamplingFactorH / maxh)
             height = int(self.__sof.AlignedHeight * c.SamplingFactorV / maxv)
             self.__buffers[ctype] = YUVBuffer(stride, height)
+        pending = {ctype: ([], []) for ctype in sos.Components}
         totalmcu = sof.MCUColumns * sof.MCURows
         for mcui in range(totalmcu):
-            log.info("*" * 48 + "\nMCU {}".format(mcui))
+            if trace:
+                tracer.MCU(mcui)
             if self.__dri > 0 and (mcui % self.__dri) == 0 and buffer.index > 0:
                 for k, v in prevDCs.items():
                     prevDCs[k] = 0
                 buffer.gotonextbyte()
                 code = buffer.readint16()
-                if (code - 0xFFD0) < 8:
-                    log.info("hit reset {}".format(code - 0xFFD0))
+                if trace and (code - 0xFFD0) < 8:
+                    tracer.Reset(code - 0xFFD0)
             for ctype, sc  in sos.Components.items():
-                log.info("\t" + "-" * 40 + "\n\tComponent {}".format(ctype))
+                if trace:
+                    tracer.Component(ctype)
                 fc : FrameComponent = sof.Components[ctype]
                 for v in range(fc.SamplingFactorV):
                     for h in range(fc.SamplingFactorH):
-                        log.info("\t\t" + "v: {} h: {} start index: {:04X} bit: {}".format(v, h, buffer.index, buffer.pos))
+                        if trace:
+                            tracer.Block(v, h, buffer.index, buffer.pos)
                         ## Huffman DC Decoding
                         DCTable = self.DCHuffmanTables[sc.HuffmanDCTable]
-                        fmtstr = "\t\t\tlnDC code: {:>16} val: {:6} prevDC: {:5} DCVal: {:5} DCbits: {:>16} DC: {:6}"
-                        lnDC, code = DCTable.DecodeChar(buffer)
+                        lnDC, code = DCTable.DecodeChar(buffer, trace)
                         if lnDC is None:
                             break
                         temp_array = [0] * 64
@@ -294,19 +308,20 @@ class JFIFFile():
                             unsignedDC = "{:016b}".format(valDC)[-lnDC:]
                             if valDC < (1 << (lnDC-1)):
                                 valDC = valDC - (1 << lnDC) + 1
-                        log.debug(fmtstr.format(code, lnDC, prevDCs[ctype], valDC, unsignedDC , valDC + prevDCs[ctype]))
+                        if trace:
+                            tracer.DC(code, lnDC, prevDCs[ctype], valDC, unsignedDC)
                         valDC += prevDCs[ctype]
                         temp_array[0] = valDC
                         prevDCs[ctype] = valDC
                         ## Huffman AC Decoding
                         ACTable = self.ACHuffmanTables[sc.HuffmanACTable]
                         index = 1
-                        fmtstr = "\t\t\tlnAC code: {:>16} val: {:6} lnZero: {:5} lnVal: {:5} ACbits: {:>16} AC: {:6}"
                         while index < 64:
                             ## RLE decoding
-                            lnAC, code = ACTable.DecodeChar(buffer)
+                            lnAC, code = ACTable.DecodeChar(buffer, trace)
                             if lnAC is None or lnAC == 0:
-                                log.debug(fmtstr.format(code, 0, 0, 0, "0", 0))
+                                if trace:
+                                    tracer.EndOfBlock(code)
                                 break
                             else:
                                 lnZero = lnAC >> 4
@@ -315,76 +330,40 @@ class JFIFFile():
                                     valAC = 0
                                 else:
                                     valAC = buffer.readbits(lnVal)
-                                    unsignedAC = "{:016b}".format(valAC)[-lnVal:]
+                                    if trace:
+                                        unsignedAC = "{:016b}".format(valAC)[-lnVal:]
                                     index += lnZero
                                     if valAC < (1 << (lnVal-1)):
                                         valAC = valAC - (1 << lnVal) + 1
                                     if index < 64:
                                         temp_array[index] = valAC
-                                log.debug(fmtstr.format(code, lnAC, lnZero, lnVal, unsignedAC, valAC))
+                                # a run without a value keeps the previous bits in the trace
+                                if trace:
+                                    tracer.AC(code, lnAC, lnZero, lnVal, unsignedAC, valAC)
                             index += 1
                         qtable = self.__quantizationtables[fc.QuantizationId]
                         uz = qtable.Unzigzag(temp_array)
-                        qu = uz[:]
-                        for i in range(64):
-                            qu[i] = (qu[i] * qtable.IDCT.qtab[i]) >> FIX_PRECISION
-                        du = qtable.IDCT.idct2d8x8(uz[:])
-                        logstr= "\t\t\t " + "_" * 171 + " \n"
-                        logstr+= "\t\t\t| {:40} | {:40} | {:40} | {:40} |\n".format("before zigzag","after zigzag", "unquantized", "idct")
-                        logstr+= "\t\t\t|{:42}|{:42}|{:42}|{:42}|\n".format("-" * 42,"-" * 42,"-" * 42,"-" * 42)
-                        for y in range(8):
-                            logstr+= "\t\t\t| {:40} | {:40} | {:40} | {:40} |\n".format(
-                                "".join(["{:5}".format(temp_array[(y * 8) + x]) for x in range(8)]),
-                                "".join(["{:5}".format(uz[(y * 8) + x]) for x in range(8)]),
-                                "".join(["{:5}".format(qu[(y * 8) + x]) for x in range(8)]),
-                                "".join(["{:5}".format(du[(y * 8) + x] >> FIX_PRECISION) for x in range(8)]),
-                            )
-                        logstr+= "\t\t\t|{:42}|{:42}|{:42}|{:42}|\n".format("_" * 41,"_" * 42,"_" * 42,"_" * 42)
-                        log.info(logstr)
                         yuvbuf: YUVBuffer = self.__buffers[ctype]
                         x = int(((mcui % sof.MCUColumns) * sof.MCUWidth + h * 8) * fc.SamplingFactorH / maxh)
                         y = int((int(mcui / sof.MCUColumns) * sof.MCUHeight + v * 8) * fc.SamplingFactorV / maxv)
                         idst = y * yuvbuf.stride + x
-                        isrc = 0
-                        for _ in range(8):
-                            yuvbuf.buffer[idst:idst + 8] = du[isrc:isrc + 8]
-                            idst += yuvbuf.stride
-                            isrc += 8
-        imagedata = bytearray(self.__sof.Height * self.__sof.Width * 3)
-        ySrc = 0
-        iDst = 0
-        yBuf : YUVBuffer = self.__buffers['Y']
-        cbBuf : YUVBuffer = self.__buffers['Cb']
-        crBuf : YUVBuffer = self.__buffers['Cr']
-        for i in range(sof.Height):
-            cbY = int(i * sof.Components['Cb'].SamplingFactorV / maxv)
-            crY = int(i * sof.Components['Cr'].SamplingFactorV / maxv)
-            for j in range(sof.Width):
-                cbX = int(j * sof.Components['Cb'].SamplingFactorH / maxh)
-                crX = int(j * sof.Components['Cr'].SamplingFactorH / maxh)
-                cbSrc = int(cbY * cbBuf.stride + cbX)
-                crSrc = int(crY * crBuf.stride + crX)
-                Y = yBuf.buffer[ySrc]
-                Cb = cbBuf.buffer[cbSrc]
-                Cr = crBuf.buffer[crSrc]
-                Y += 128 << FIX_PRECISION
-                r = clamp(int(Y + (FLOAT2FIX(1.402) * Cr >> FIX_PRECISION) >> FIX_PRECISION),0,255)
-                g = clamp(int(
-                        Y -(FLOAT2FIX(0.34414) * Cb >> FIX_PRECISION) - 
-                        (FLOAT2FIX(0.71414) * Cr >> FIX_PRECISION) >> FIX_PRECISION)
-                        ,0,255)
-                b = clamp(int(Y + (FLOAT2FIX(1.772) * Cb >> FIX_PRECISION) >> FIX_PRECISION),0,255)
-                imagedata[iDst] = r
-                imagedata[iDst+1] = g
-                imagedata[iDst+2] = b
-                iDst +=3
-                ySrc +=1
-            ySrc -= sof.Width
-            ySrc += yBuf.stride
-        image = Image.frombytes("RGB", (self.__sof.Width, self.__sof.Height), bytes(imagedata))
-        image.save(filename)
-        for handler in log.handlers[:]:
-            log.removeHandler(handler)
+                        if trace:
+                            du = qtable.IDCT.Transform(uz, idctmode)
+                            qu = [(uz[i] * qtable.IDCT.qtab[i]) >> FIX_PRECISION for i in range(64)]
+                            tracer.Coefficients(temp_array, uz, qu, (du >> FIX_PRECISION).ravel().tolist())
+                            yuvbuf.StoreBlocks([idst], du)
+                        else:
+                            pending[ctype][0].append(idst)
+                            pending[ctype][1].append(uz)
+        for ctype, (offsets, blocks) in pending.items():
+            if offsets:
+                idct = self.__quantizationtables[sof.Components[ctype].QuantizationId].IDCT
+                self.__buffers[ctype].StoreBlocks(offsets, idct.Transform(blocks, idctmode))
+        imagedata = YCbCrToRGB(self.__buffers, sof, chromamode)
+        image = Image.fromarray(imagedata, "RGB")
+        if filename is not None:
+            image.save(filename)
+        return image
 
 if __name__ == "__main__":
     from json import dump
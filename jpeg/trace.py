@@ -0,0 +1,104 @@
+import json
+import sys
+
+DC_FORMAT = "\t\t\tlnDC code: {:>16} val: {:6} prevDC: {:5} DCVal: {:5} DCbits: {:>16} DC: {:6}"
+AC_FORMAT = "\t\t\tlnAC code: {:>16} val: {:6} lnZero: {:5} lnVal: {:5} ACbits: {:>16} AC: {:6}"
+
+class Tracer():
+    # decode events, one JSON array per line; Decode only calls into it
+    # when one is passed, so an untraced decode pays nothing
+    def __init__(self, filename):
+        self.Filename = filename
+        self.__file = open(filename, "w", encoding="utf-8")
+
+    def __write(self, *event):
+        self.__file.write(json.dumps(event, separators=(",", ":")))
+        self.__file.write("\n")
+
+    def MCU(self, index):
+        self.__write("mcu", index)
+
+    def Reset(self, marker):
+        self.__write("reset", marker)
+
+    def Component(self, ctype):
+        self.__write("component", ctype)
+
+    def Block(self, v, h, index, pos):
+        self.__write("block", v, h, index, pos)
+
+    def DC(self, code, length, prev, value, bits):
+        self.__write("dc", code, length, prev, value, bits)
+
+    def AC(self, code, symbol, zeros, length, bits, value):
+        self.__write("ac", code, symbol, zeros, length, bits, value)
+
+    def EndOfBlock(self, code):
+        self.__write("eob", code)
+
+    def Coefficients(self, zigzag, unzigzag, unquantized, idct):
+        self.__write("coefficients", zigzag, unzigzag, unquantized, idct)
+
+    def Close(self):
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.Close()
+
+
+def ReadTrace(filename):
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _table(zigzag, unzigzag, unquantized, idct):
+    lines = ["\t\t\t " + "_" * 171 + " "]
+    lines.append("\t\t\t| {:40} | {:40} | {:40} | {:40} |".format("before zigzag","after zigzag", "unquantized", "idct"))
+    lines.append("\t\t\t|{:42}|{:42}|{:42}|{:42}|".format("-" * 42,"-" * 42,"-" * 42,"-" * 42))
+    for y in range(8):
+        lines.append("\t\t\t| {:40} | {:40} | {:40} | {:40} |".format(
+            *("".join("{:5}".format(values[(y * 8) + x]) for x in range(8)) for values in (zigzag, unzigzag, unquantized, idct))
+        ))
+    lines.append("\t\t\t|{:42}|{:42}|{:42}|{:42}|".format("_" * 41,"_" * 42,"_" * 42,"_" * 42))
+    lines.append("")
+    return "\n".join(lines)
+
+
+def Render(events):
+    # the text tables the decoder used to log, one line per event
+    for event in events:
+        kind = event[0]
+        if kind == "mcu":
+            yield "*" * 48 + "\nMCU {}".format(event[1])
+        elif kind == "reset":
+            yield "hit reset {}".format(event[1])
+        elif kind == "component":
+            yield "\t" + "-" * 40 + "\n\tComponent {}".format(event[1])
+        elif kind == "block":
+            yield "\t\t" + "v: {} h: {} start index: {:04X} bit: {}".format(*event[1:])
+        elif kind == "dc":
+            code, length, prev, value, bits = event[1:]
+            yield DC_FORMAT.format(code, length, prev, value, bits, value + prev)
+        elif kind == "ac":
+            yield AC_FORMAT.format(*event[1:])
+        elif kind == "eob":
+            yield AC_FORMAT.format(event[1], 0, 0, 0, "0", 0)
+        elif kind == "coefficients":
+            yield _table(*event[1:])
+
+
+def RenderFile(tracefilename, logfilename):
+    with open(logfilename, "w", encoding="utf-8") as o:
+        for line in Render(ReadTrace(tracefilename)):
+            o.write(line + "\n")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: trace.py decode.jsonl decode.log")
+    else:
+        RenderFile(sys.argv[1], sys.argv[2])
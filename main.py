@@ -1,7 +1,94 @@
 from iso9660 import ISOImage
+from demux import AudioSink, VideoSink, FrameSink
+from manifest import Manifest
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
 import argparse
+import shutil
 import os
 
+STAGING_FOLDER = ".jobs"
+
+image = None
+
+
+def Extract(image, f, destination, audio, video, frame, limit, manifest=None, native=False):
+    # one pass over the file feeds every requested output
+    sinks = []
+    if audio:
+        sinks.append(AudioSink(os.path.join(destination,"audio"), limit, manifest, native))
+    if video:
+        sinks.append(VideoSink(os.path.join(destination,"video"), limit, manifest))
+    if frame:
+        sinks.append(FrameSink(os.path.join(destination,"frames"), limit, manifest))
+    if sinks:
+        image.Extract(f, sinks)
+
+
+def OpenWorker(cue_path, usemmap, usecache, prefetch, prefetchchunk):
+    # each worker opens the image once, the index comes from the cache the
+    # parent process has just written
+    global image
+    image = ISOImage(cue_path, usemmap, usecache, False, prefetch, prefetchchunk)
+
+
+def ExtractWorker(index, staging, destination, audio, video, frame, limit, usemanifest, native):
+    # outputs are checked against the destination but written to staging,
+    # the parent records them once they are moved into place
+    os.makedirs(staging, exist_ok=True)
+    manifest = Manifest(staging, destination) if usemanifest else None
+    Extract(image, image.Files[index], staging, audio, video, frame, limit, manifest, native)
+    if manifest is None:
+        return {}, []
+    return manifest.Written, manifest.Skipped
+
+
+def Merge(staging, destination):
+    # later files overwrite earlier ones exactly like the serial loop does
+    for root, _, files in os.walk(staging):
+        target = os.path.join(destination, os.path.relpath(root, staging))
+        os.makedirs(target, exist_ok=True)
+        for name in files:
+            os.replace(os.path.join(root, name), os.path.join(target, name))
+    shutil.rmtree(staging)
+
+
+def ExtractParallel(i, args, manifest):
+    files = i.Files
+    staging = os.path.join(args.destination, STAGING_FOLDER)
+    initargs = (args.cue_path, args.mmap, not args.no_cache, args.prefetch, args.prefetch_chunk)
+    with ProcessPoolExecutor(args.jobs, initializer=OpenWorker, initargs=initargs) as pool:
+        futures = [
+            pool.submit(ExtractWorker, n, os.path.join(staging, str(n)), args.destination,
+                        args.audio, args.video, args.frame, args.limit, manifest is not None, args.native_rate)
+            for n in range(len(files))
+        ]
+        merged = 0
+        written = set()
+        with tqdm(total=len(files), unit="file") as progress:
+            for future in as_completed(futures):
+                future.result()
+                progress.update()
+                while merged < len(futures) and futures[merged].done():
+                    tqdm.write(str(files[merged]))
+                    stage = os.path.join(staging, str(merged))
+                    if os.path.exists(stage):
+                        Merge(stage, args.destination)
+                    entries, skipped = futures[merged].result()
+                    if manifest is not None:
+                        manifest.Update(entries)
+                        if written.intersection(skipped):
+                            # an earlier file of this run replaced an output the
+                            # worker found current, redo the file in order
+                            Extract(i, files[merged], args.destination, args.audio, args.video,
+                                    args.frame, args.limit, manifest, args.native_rate)
+                        manifest.Save()
+                    written.update(entries)
+                    merged += 1
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Stream extractor of Playdia games")
     parser.add_argument("-c", "--cue_path", default="input/Dragon Ball Z - Shin Saiyajin Zetsumetsu Keikaku - Chikyuu Hen (Japan).cue",help="Input CUE file path")
@@ -10,14 +97,34 @@ if __name__ == "__main__":
     parser.add_argument("-a", "--audio", action="store_true", help="Extract audio tracks (default=False)")
     parser.add_argument("-v", "--video", action="store_true", help="Extract video tracks (default=False)")
     parser.add_argument("-f", "--frame", action="store_true", help="Extract video frames (default=False)")
+    parser.add_argument("--native-rate", action="store_true", help="Write audio at the XA sample rate of the clip instead of resampling to 44100 Hz (default=False)")
+    parser.add_argument("-j", "--jobs", default=1, type=int, help="Extract files in this many worker processes (default=1)")
+    parser.add_argument("--no-manifest", action="store_true", help="Rewrite every output instead of skipping the ones listed as current in the destination manifest (default=False)")
+    parser.add_argument("--verify", action="store_true", help="Check the EDC/ECC of every Mode 2 sector and list the bad LBAs (default=False)")
+    parser.add_argument("-m", "--mmap", action="store_true", help="Memory-map the BIN tracks instead of seeking (default=False)")
+    parser.add_argument("-r", "--rebuild-index", action="store_true", help="Rebuild the sector index cache next to the CUE file (default=False)")
+    parser.add_argument("-p", "--prefetch", default=0, type=int, help="Read ahead this many chunks of sectors on a background thread (0=off)")
+    parser.add_argument("--prefetch-chunk", default=32, type=int, help="Sectors per read-ahead chunk (default=32)")
+    parser.add_argument("--pack", default=None, help="Write the disc to a compressed sector container (.cdz) at this path")
+    parser.add_argument("--pack-compression", default="zlib", choices=["zlib", "lzma"], help="Compression of the container chunks (default=zlib)")
+    parser.add_argument("--no-cache", action="store_true", help="Neither read nor write the sector index cache (default=False)")
 
     args = parser.parse_args()
-    i = ISOImage(args.cue_path)
-    for f in i.Files:
-        print(f)
-        if args.audio:
-            i.ReadAudio(f, os.path.join(args.destination,"audio"), args.limit)
-        if args.video:
-            i.ReadVideo(f, os.path.join(args.destination,"video"), args.limit)
-        if args.frame:
-            i.ReadVideoFrames(f, os.path.join(args.destination,"frames"), args.limit)
+    i = ISOImage(args.cue_path, args.mmap, not args.no_cache, args.rebuild_index, args.prefetch, args.prefetch_chunk)
+    if args.pack:
+        i.Pack(args.pack, args.pack_compression)
+    if args.verify:
+        bad = i.Verify()
+        print("{} sectors with bad EDC/ECC".format(len(bad)))
+        for lba in bad:
+            print("  LBA {}".format(lba))
+    manifest = None if args.no_manifest else Manifest(args.destination)
+    if args.jobs > 1 and len(i.Files) > 1:
+        ExtractParallel(i, args, manifest)
+    else:
+        for f in i.Files:
+            print(f)
+            Extract(i, f, args.destination, args.audio, args.video, args.frame, args.limit, manifest, args.native_rate)
+            if manifest is not None:
+                manifest.Save()
+    i.Close()
@@ -0,0 +1,82 @@
+import os
+import json
+import hashlib
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def SourceHash():
+    return hashlib.blake2b(digest_size=16)
+
+
+class Manifest():
+    # keys are output paths relative to folder; outputs written by a worker
+    # into a staging folder are checked against the final destination instead
+    def __init__(self, folder, destination=None):
+        self.Folder = folder
+        self.__destination = folder if destination is None else destination
+        self.__path = os.path.join(self.__destination, MANIFEST_NAME)
+        self.__entries = {}
+        self.Written = {}
+        self.Skipped = []
+        if os.path.exists(self.__path):
+            try:
+                with open(self.__path, "r") as f:
+                    data = json.load(f)
+                if data.get("version") == MANIFEST_VERSION:
+                    self.__entries = data["outputs"]
+            except (OSError, ValueError, KeyError):
+                self.__entries = {}
+
+    def Key(self, filename):
+        return os.path.relpath(filename, self.Folder).replace(os.sep, "/")
+
+    def __entry(self, lbas, digest, options):
+        return {
+            "first": int(lbas[0]) if len(lbas) else None,
+            "last": int(lbas[-1]) if len(lbas) else None,
+            "sectors": len(lbas),
+            "hash": digest,
+            "options": options
+        }
+
+    def Current(self, filename, lbas, digest, options):
+        key = self.Key(filename)
+        entry = self.__entries.get(key)
+        if entry is None:
+            return False
+        expected = self.__entry(lbas, digest, options)
+        if any(entry.get(k) != v for k, v in expected.items()):
+            return False
+        target = os.path.join(self.__destination, key)
+        if not os.path.exists(target) or os.path.getsize(target) != entry.get("size"):
+            return False
+        self.Skipped.append(key)
+        return True
+
+    def Record(self, filename, lbas, digest, options):
+        entry = self.__entry(lbas, digest, options)
+        entry["size"] = os.path.getsize(filename)
+        key = self.Key(filename)
+        self.__entries[key] = entry
+        self.Written[key] = entry
+
+    def Update(self, entries):
+        self.__entries.update(entries)
+        self.Written.update(entries)
+
+    def Save(self):
+        tmppath = self.__path + ".tmp"
+        os.makedirs(self.__destination, exist_ok=True)
+        with open(tmppath, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "outputs": self.__entries}, f, indent=1, sort_keys=True)
+        os.replace(tmppath, self.__path)
+
+    @property
+    def Path(self):
+        return self.__path
+
+    @property
+    def Entries(self):
+        return self.__entries
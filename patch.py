@@ -0,0 +1,106 @@
+from sector import Submodes
+
+AUDIO = Submodes.Audio.value
+FORM2 = Submodes.Form.value
+# end of the F2 header, the patched bytes are pushed in behind it
+F2_OFFSET = 0x23
+
+
+class PatchTransaction():
+    # patches are laid out against working copies first, the sectors only
+    # change on Commit and every change is journaled so it can be undone
+    def __init__(self, imagestream):
+        self.__imagestream = imagestream
+        self.__patches = []
+        self.__journal = []
+
+    def Add(self, sectorId, data, offset=0x28):
+        self.__patches.append((sectorId, bytes(data), offset))
+
+    def __payload(self, LBA, working):
+        data = working.get(LBA)
+        if data is None:
+            data = bytearray(self.__imagestream.ReadSector(LBA).Data)
+            working[LBA] = data
+        return data
+
+    def __chain(self, sectorId, offset, working):
+        # the F1 sectors an insertion ripples through, ending on the F2
+        submodes = self.__imagestream.Index["submode"]
+        chain = []
+        lba = sectorId
+        while True:
+            data = self.__payload(lba, working)
+            if data[0] == 0xF2:
+                chain.append((lba, F2_OFFSET))
+                return chain
+            if not (submodes[lba] & AUDIO) and data[0] == 0xF1:
+                chain.append((lba, offset if not chain else 1))
+            lba += 1
+            while submodes[lba] & AUDIO:
+                lba += 1
+
+    def __shift(self, chain, data, working):
+        # everything behind the insertion points moves as one stream, each
+        # sector then takes what fits after its fixed prefix and the F2 drops
+        # whatever is left over
+        submodes = self.__imagestream.Index["submode"]
+        parts = [data]
+        prefixes = []
+        for lba, offset in chain:
+            payload = working[lba]
+            prefixes.append(payload[:offset])
+            parts.append(payload[offset:])
+        stream = memoryview(b"".join(parts))
+        position = 0
+        for (lba, offset), prefix in zip(chain, prefixes):
+            length = 2324 if (submodes[lba] & FORM2) else 2048
+            take = length - len(prefix)
+            working[lba] = prefix + stream[position:position + take]
+            position += take
+
+    def Plan(self):
+        working = {}
+        changed = set()
+        for sectorId, data, offset in self.__patches:
+            chain = self.__chain(sectorId, offset, working)
+            self.__shift(chain, data, working)
+            changed.update(lba for lba, _ in chain)
+        return {lba: bytes(working[lba]) for lba in sorted(changed)}
+
+    def Commit(self):
+        plan = self.Plan()
+        try:
+            for lba, data in plan.items():
+                sector = self.__imagestream.ReadSector(lba)
+                self.__journal.append((sector, sector.Data, sector.Modified))
+                sector.Data = data
+                sector.Modified = True
+        except BaseException:
+            self.Rollback()
+            raise
+        self.__patches = []
+        return plan
+
+    def Rollback(self):
+        while self.__journal:
+            sector, data, modified = self.__journal.pop()
+            sector.Data = data
+            sector.Modified = modified
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.Commit()
+        else:
+            self.__patches = []
+
+    @property
+    def Patches(self):
+        return self.__patches
+
+    @property
+    def Journal(self):
+        return self.__journal
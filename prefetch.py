@@ -0,0 +1,69 @@
+import queue
+import threading
+
+PUT_TIMEOUT = 0.1
+
+
+class Prefetcher():
+    __done = object()
+
+    def __init__(self, imagestream, lbas, depth=8, chunksize=32):
+        self.__imagestream = imagestream
+        self.__lbas = lbas
+        self.__chunksize = max(1, chunksize)
+        self.__queue = queue.Queue(maxsize=max(1, depth))
+        self.__stop = threading.Event()
+        self.__finished = False
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def __put(self, item):
+        # give up once the consumer has stopped listening
+        while not self.__stop.is_set():
+            try:
+                self.__queue.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __run(self):
+        try:
+            for start in range(0, len(self.__lbas), self.__chunksize):
+                lbas = self.__lbas[start:start + self.__chunksize]
+                # copy the payloads here so page faults and reads land on
+                # this thread instead of the decoder
+                chunk = [(lba, bytes(payload)) for lba, payload in self.__imagestream.ReadPayloads(lbas)]
+                if not self.__put(chunk):
+                    return
+        except Exception as e:
+            self.__put(e)
+            return
+        self.__put(self.__done)
+
+    def __iter__(self):
+        while not self.__finished:
+            item = self.__queue.get()
+            if item is self.__done:
+                self.__finished = True
+            elif isinstance(item, Exception):
+                self.__finished = True
+                raise item
+            else:
+                yield from item
+
+    def Close(self):
+        self.__stop.set()
+        self.__finished = True
+        while True:
+            try:
+                self.__queue.get_nowait()
+            except queue.Empty:
+                break
+        self.__thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.Close()
@@ -1,5 +1,38 @@
 from enum import Enum, Flag, auto
-from struct import pack, unpack
+import numpy as np
+
+SECTOR_SIZE = 2352
+HEADER_SIZE = 24
+
+# raw layout of a Mode 2 sector, used to pull the headers of a whole
+# track out of the file in one go
+RAW_SECTOR = np.dtype([
+    ("sync", "V12"),
+    ("minute", "u1"),
+    ("second", "u1"),
+    ("block", "u1"),
+    ("mode", "u1"),
+    ("filenumber", "u1"),
+    ("channel", "u1"),
+    ("submode", "u1"),
+    ("coding", "u1"),
+    ("body", "V{}".format(SECTOR_SIZE - 20))
+])
+
+HEADER_FIELDS = ("minute", "second", "block", "mode", "filenumber", "channel", "submode", "coding")
+
+SECTOR_INDEX = np.dtype([
+    ("minute", "u1"),
+    ("second", "u1"),
+    ("block", "u1"),
+    ("mode", "u1"),
+    ("filenumber", "u1"),
+    ("channel", "u1"),
+    ("submode", "u1"),
+    ("coding", "u1"),
+    ("streamid", "u2"),
+    ("offset", "u8")
+])
 
 
 class Submodes(Flag):
@@ -18,51 +51,30 @@ class Codings(Flag):
     EightBit = 0x10
 
 class Sector():
+    # one of these exists for every sector that has been looked at, so keep
+    # the raw header around and only decode the flags when they are asked for
+    __slots__ = ("__header", "__filestreamid", "__filestreamoffset", "__data", "__ecc", "__modified")
+
     def __init__(self, data, filestreamid, filestreamoffset):
         self.__filestreamid = filestreamid
         self.__filestreamoffset = filestreamoffset
-        header = unpack("<12sBBBBBBBBI", data)
-        self.__syncpattern = header[0]
-        self.__minute = header[1]
-        self.__second = header[2]
-        self.__block = header[3]
-        self.__mode = header[4]
-        self.__filenumber = header[5]
-        self.__channel = header[6]
-        self.__submode = Submodes(header[7])
-        self.__coding = Codings(header[8])
+        self.__header = bytes(data)
         self.__data = None
         self.__ecc = None
         self.__modified = False
 
     def insertData(self, data, offset):
         sectorlen = 2324 if (self.Submode & Submodes.Form) else 2048
-        newdata = list(self.Data[:])
+        newdata = bytearray(self.Data)
         newdata[offset:offset] = data
         popped = newdata[sectorlen:]
-        self.Data = b''.join([i.to_bytes(1, 'little') for i in newdata[:sectorlen]])
+        self.Data = bytes(newdata[:sectorlen])
         self.__modified = True
         return popped
 
     def ToBytes(self):
-        bytes = bytearray(
-            pack(
-                "<12sBBBBBBBBBBBB",
-                self.__syncpattern,
-                self.__minute,
-                self.__second,
-                self.__block,
-                self.__mode, 
-                self.__filenumber,
-                self.__channel,
-                self.__submode.value,
-                self.__coding.value,
-                self.__filenumber,
-                self.__channel,
-                self.__submode.value,
-                self.__coding.value
-            )
-        )
+        bytes = bytearray(self.__header[:20])
+        bytes.extend(self.__header[16:20])
         bytes.extend(self.Data)
         bytes.extend(self.ECC)
         return bytes
@@ -75,41 +87,48 @@ class Sector():
     def FileStreamOffset(self):
         return self.__filestreamoffset
 
+    @property
+    def Header(self):
+        return self.__header
+
     @property
     def SyncPattern(self):
-        return self.__syncpattern
+        return self.__header[:12]
 
     @property
     def Minute(self):
-        return (self.__minute & 0xF + (10 * (self.__minute >> 4)))
+        minute = self.__header[12]
+        return (minute & 0xF + (10 * (minute >> 4)))
 
     @property
     def Second(self):
-        return (self.__second & 0xF + (10 * (self.__second >> 4)))
+        second = self.__header[13]
+        return (second & 0xF + (10 * (second >> 4)))
 
     @property
     def Block(self):
-        return (self.__block & 0xF + (10 * (self.__block >> 4)))
+        block = self.__header[14]
+        return (block & 0xF + (10 * (block >> 4)))
 
     @property
     def Mode(self):
-        return self.__mode
+        return self.__header[15]
 
     @property
     def FileNumber(self):
-        return self.__filenumber
+        return self.__header[16]
 
     @property
     def Channel(self):
-        return self.__channel
+        return self.__header[17]
 
     @property
     def Submode(self):
-        return self.__submode
+        return Submodes(self.__header[18])
 
     @property
     def Coding(self):
-        return self.__coding
+        return Codings(self.__header[19])
 
     @property
     def Data(self):
@@ -131,13 +150,17 @@ class Sector():
     def Modified(self):
         return self.__modified
 
+    @Modified.setter
+    def Modified(self, value):
+        self.__modified = value
+
     def __repr__(self):
         formatstr = '<Sector Mode {} File {} Channel {} {} {}>'
         result = formatstr.format(
-            self.__mode,
-            self.__filenumber,
-            self.__channel,
-            self.__submode,
-            self.__coding
+            self.Mode,
+            self.FileNumber,
+            self.Channel,
+            self.Submode,
+            self.Coding
         )
         return result
@@ -1,16 +1,22 @@
 from jpeg.jpeg import JFIFFile
 from jpeg.bitbuffer import BitBuffer
+from jpeg.trace import Tracer, RenderFile
 from json import load
 from tqdm import tqdm
 from iso9660 import ISOImage, TimeToLBA
+import os
 
-def main(inputfile, ysamplingfactorv, ysamplingfactorh, index):
-    with open(inputfile, "rb") as f:
-        scandata = f.read()
+def main(inputcuepath, inputfilepath, streamindex, frameindex, ysamplingfactorv, ysamplingfactorh, index):
+    i = ISOImage(inputcuepath)
     with open("config.json", "r") as f:
         config = load(f)
-    lstdata = [scandata[idx] for idx in range(len(scandata)) if (idx % 0x800) != 0]
-    buffer = BitBuffer(bytearray(lstdata))
+    for frame in i.IterFrames(i.Find(inputfilepath), streamindex + 1):
+        if frame.StreamIndex == streamindex and frame.FrameIndex == frameindex:
+            break
+    else:
+        print("frame {:03}/{:04} not found".format(streamindex, frameindex))
+        return
+    buffer = BitBuffer(frame.ScanData)
     j = JFIFFile(dict=config)
     j.SOF.cache = {}
     j.SOF.Components["Y"].SamplingFactorV = ysamplingfactorv
@@ -18,10 +24,15 @@ def main(inputfile, ysamplingfactorv, ysamplingfactorh, index):
     buffer.index = index
     buffer.pos = 0
     filename = "output/test/factor_v{}_h{}/index_{:04}.png".format(ysamplingfactorv, ysamplingfactorh, index)
+    tracepath = filename.replace(".png", ".jsonl")
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
     try:
-        j.Decode(buffer, filename)
+        with Tracer(tracepath) as tracer:
+            j.Decode(buffer, filename, tracer)
     except Exception as err:
         print(err)
+    # a failed decode still leaves the trace up to the error
+    RenderFile(tracepath, filename.replace(".png", ".log"))
 
 def test_patch(inputcuepath, inputdatapath,  outputpath, outputname, minute, second, block, offset):
     i = ISOImage(inputcuepath)
@@ -31,5 +42,5 @@ def test_patch(inputcuepath, inputdatapath,  outputpath, outputname, minute, sec
     i.Write(outputpath, outputname)
 
 if __name__ == '__main__':
-    # main("output/001/frame_0015.bin",1, 2, 0x27)
+    # main("input/Dragon Ball Z - Shin Saiyajin Zetsumetsu Keikaku - Chikyuu Hen (Japan).cue", "MOVIE.STR", 1, 15, 1, 2, 0x27)
     test_patch("input/Dragon Ball Z - Shin Saiyajin Zetsumetsu Keikaku - Chikyuu Hen (Japan).cue", "input/patch.bin", "output", "DBZ_TEST", 1, 4,60, 0x28)
\ No newline at end of file